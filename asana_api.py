@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import gzip
+import json
+import urllib
+import logging
+import itertools
+import threading
+import pyasana
+
+from datetime import date, datetime
+from metrics import metrics
+from scheduler import Scheduler, LISTING, HYDRATION
+
+log = logging.getLogger()
+
+# The fields that are needed to write a report, requesting only these keeps
+# the list responses small and removes the need to fetch each task separately.
+TASK_FIELDS = ['name', 'completed', 'completed_at', 'modified_at', 'assignee.name']
+# Tasks that are listed by assignee also need their projects.
+ASSIGNEE_TASK_FIELDS = TASK_FIELDS + ['projects.name']
+
+
+class Api(pyasana.Api):
+	'''
+	Extends pyasana.Api with the query options of the Asana tasks endpoint
+	that pyasana does not expose: completed_since, opt_fields and pagination.
+	'''
+	def __init__(self, apikey=None, api_limit=100, page_size=100, max_api_limit=None):
+		super(Api, self).__init__(apikey, api_limit)
+		self.page_size = page_size
+		self.scheduler = Scheduler(api_limit, max_api_limit) if api_limit != -1 else None
+
+	def format_timestamp(self, obs_date):
+		return '%sT00:00:00.000Z' % obs_date.isoformat()
+
+	def format_datetime(self, obs_datetime):
+		return obs_datetime.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+	def find_tasks(self, project=None, workspace=None, assignee=None, completed_since=None, modified_since=None, fields=TASK_FIELDS):
+		return list(self.iter_tasks(project, workspace, assignee, completed_since, modified_since, fields))
+
+	def iter_tasks(self, project=None, workspace=None, assignee=None, completed_since=None, modified_since=None, fields=TASK_FIELDS):
+		'''
+		Returns the tasks of a project (or of an assignee within a workspace)
+		with only the requested fields filled in. When completed_since is given
+		only tasks that are still open or that have been completed since that
+		date are returned, when modified_since (an ISO 8601 timestamp) is given
+		only tasks that have changed since then are returned. The next page is
+		only requested once the tasks of the previous one have been consumed.
+		'''
+		if project is None and (workspace is None or assignee is None):
+			raise pyasana.AsanaError('Need to specify a project or a workspace and assignee')
+		params = {}
+		if project:
+			params['project'] = project
+		else:
+			params['workspace'] = workspace
+			params['assignee'] = assignee
+		if completed_since:
+			params['completed_since'] = self.format_timestamp(completed_since)
+		if modified_since:
+			params['modified_since'] = modified_since
+		if fields:
+			params['opt_fields'] = ','.join(fields)
+		return itertools.imap(pyasana.Task.new_from_json, self.iter_pages('%s/tasks' % self.API_BASE, params))
+
+	def get_workspace_users(self, workspace):
+		return [pyasana.User.new_from_json(x) for x in self.iter_pages('%s/workspaces/%s/users' % (self.API_BASE, workspace), {})]
+
+	def close(self):
+		pass
+
+	def _fetch_url(self, url, post_data=None, parameters=None):
+		'''
+		Sends a request through the scheduler, which keeps to api_limit
+		requests a minute and retries throttled requests. pyasana's own
+		throttle, a pause of a minute after every 100 requests, is bypassed.
+		Fetching a single task has a lower priority than listing.
+		'''
+		endpoint = self.endpoint(url)
+		fetch = pyasana.Api.__dict__['_fetch_url'].api_function
+		def request():
+			with metrics.timer('asana_request', endpoint=endpoint):
+				return fetch(self, url, post_data, parameters)
+		if self.scheduler is None:
+			return request()
+		return self.scheduler.call(request, HYDRATION if endpoint == 'tasks/:id' else LISTING)
+
+	def endpoint(self, url):
+		'''
+		Returns the path of url relative to API_BASE with the ids replaced by
+		:id, e.g. workspaces/:id/projects.
+		'''
+		path = url[len(self.API_BASE):] if url.startswith(self.API_BASE) else url
+		return '/'.join([':id' if part.isdigit() else part for part in path.split('?')[0].strip('/').split('/')])
+
+	def iter_pages(self, url, params):
+		'''
+		Follows the next_page offsets of a list endpoint, yielding the results
+		of each page before the next one is requested.
+		'''
+		params = dict(params)
+		params['limit'] = self.page_size
+		while True:
+			data = json.loads(self._fetch_url(url, parameters=params))
+			for result in data['data']:
+				yield result
+			next_page = data.get('next_page')
+			if not next_page or not next_page.get('offset'):
+				break
+			params['offset'] = next_page.get('offset')
+
+
+class Archive(object):
+	'''
+	A gzipped JSON file with the raw Asana responses of a crawl, keyed by
+	request URL and parameters, together with the date on which they were
+	recorded.
+	'''
+	archives = {}
+
+	def __init__(self, path, recorded_on=None, responses=None):
+		self.path = path
+		self.recorded_on = recorded_on or date.today()
+		self.responses = responses or {}
+		self.lock = threading.Lock()
+
+	@classmethod
+	def load(cls, path):
+		if path not in cls.archives:
+			fh = gzip.open(path, 'rb')
+			data = json.load(fh)
+			fh.close()
+			recorded_on = datetime.strptime(data['recorded_on'], '%Y-%m-%d').date()
+			cls.archives[path] = cls(path, recorded_on, data['responses'])
+			log.info('Loaded %s Asana responses recorded on %s from %s' % (len(data['responses']), recorded_on, path))
+		return cls.archives[path]
+
+	def key(self, url, parameters=None):
+		if parameters:
+			return '%s?%s' % (url, urllib.urlencode(sorted(parameters.items())))
+		return url
+
+	def get(self, url, parameters=None):
+		key = self.key(url, parameters)
+		if key not in self.responses:
+			raise pyasana.AsanaError('Request %s is not in archive %s' % (key, self.path))
+		return self.responses[key]
+
+	def add(self, url, parameters, response):
+		with self.lock:
+			self.responses[self.key(url, parameters)] = response
+
+	def save(self):
+		with self.lock:
+			fh = gzip.open(self.path, 'wb')
+			json.dump({'recorded_on': str(self.recorded_on), 'responses': self.responses}, fh, separators=(',', ':'))
+			fh.close()
+		log.info('Saved %s Asana responses to %s' % (len(self.responses), self.path))
+
+
+class RecordingApi(Api):
+	'''
+	Saves every response it receives from Asana in an archive that can later
+	be replayed with ReplayApi.
+	'''
+	def __init__(self, archive_path, apikey=None, api_limit=100, page_size=100, max_api_limit=None):
+		super(RecordingApi, self).__init__(apikey, api_limit, page_size, max_api_limit)
+		self.archive = Archive(archive_path)
+
+	def _fetch_url(self, url, post_data=None, parameters=None):
+		response = super(RecordingApi, self)._fetch_url(url, post_data, parameters)
+		self.archive.add(url, parameters, response)
+		return response
+
+	def close(self):
+		if self.archive.responses:
+			self.archive.save()
+
+
+class ReplayApi(Api):
+	'''
+	Answers every request from an archive made by RecordingApi without going
+	to the network.
+	'''
+	def __init__(self, archive_path, apikey=None, api_limit=100, page_size=100, max_api_limit=None):
+		super(ReplayApi, self).__init__(apikey, api_limit, page_size, max_api_limit)
+		self.archive = Archive.load(archive_path)
+
+	def _fetch_url(self, url, post_data=None, parameters=None):
+		return self.archive.get(url, parameters)
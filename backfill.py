@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import json
+import Queue
+import signal
+import logging
+import threading
+import multiprocessing
+
+from collections import namedtuple
+from report import Report
+from sender import Dispatcher
+
+log = logging.getLogger()
+
+# Seconds that rendering a single job may take. Waiting for a result with
+# a timeout keeps the wait interruptible with Ctrl-C.
+RENDER_TIMEOUT = 3600
+
+Job = namedtuple('Job', ['report', 'start_date', 'end_date', 'output_format', 'project', 'url'])
+
+# The tasks, frequency and statistics of the report that is being backfilled, set in
+# every worker process when the pool is started.
+worker = {}
+
+
+def init_worker(tasks, frequency, statistics):
+	# an interrupt is handled by the parent, which terminates the pool
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	worker['tasks'] = tasks
+	worker['frequency'] = frequency
+	worker['statistics'] = statistics
+
+
+def render_job(job):
+	'''
+	Renders the status of a single report window for one output and project
+	to report, returns the job with the subject and the status. The subject
+	is None when there were no completed tasks to report.
+	'''
+	report = Report(worker['tasks'], job.start_date, job.end_date, {}, worker['frequency'], False, True, worker['statistics'])
+	if job.project == 'All':
+		projects = worker['tasks'].group_by_project(job.start_date)
+	else:
+		projects = worker['tasks'].group_by_project(job.start_date, job.project)
+	report.create_status(projects, job.output_format, job.start_date, None if job.project == 'All' else job.project)
+	return job, report.subject, report.status.getvalue()
+
+
+class BackfillState(object):
+	'''
+	A JSON file with the jobs of a backfill that have been delivered, so that
+	an interrupted backfill can be resumed without delivering them again.
+	'''
+	def __init__(self, path):
+		self.path = os.path.expanduser(path)
+		self.lock = threading.Lock()
+		self.done = set()
+		if os.path.exists(self.path):
+			fh = open(self.path, 'r')
+			self.done = set(json.load(fh))
+			fh.close()
+			log.info('Resuming backfill, %s jobs have already been delivered' % len(self.done))
+
+	def key(self, job):
+		return '|'.join([job.report, str(job.start_date), job.output_format, job.project, job.url])
+
+	def is_done(self, job):
+		return self.key(job) in self.done
+
+	def add(self, job):
+		with self.lock:
+			self.done.add(self.key(job))
+			fh = open('%s.tmp' % self.path, 'w')
+			json.dump(sorted(self.done), fh)
+			fh.close()
+			os.rename('%s.tmp' % self.path, self.path)
+
+
+class Backfill(object):
+	'''
+	Renders and delivers the report of every window of a Progress as
+	independent (window, output, project) jobs. The jobs are rendered in a
+	pool of processes and handed to one delivery thread per output through a
+	bounded queue, so rendering stops running ahead when delivery is slow.
+	Jobs are rendered and delivered oldest window first, in the same order
+	for every destination.
+	'''
+	def __init__(self, progress, state, processes=None, queue_size=16):
+		self.progress = progress
+		self.state = state
+		self.processes = processes or multiprocessing.cpu_count()
+		self.queue_size = queue_size
+		self.failures = []
+		self.delivered = 0
+
+	def jobs(self):
+		for output_format in sorted(self.progress.output.keys()):
+			settings = self.progress.output.get(output_format) or {}
+			for project, url in sorted(settings.get('projects', {}).iteritems()):
+				for start_date, end_date in sorted(self.progress.windows):
+					yield Job(self.progress.name, start_date, end_date, output_format, project, url)
+
+	def deliver(self, output_format, queue):
+		'''
+		Delivers the rendered jobs of an output until the end of the queue.
+		Senders queue their reports, so the jobs are only recorded as done
+		once the output has been flushed, after every queue_size jobs and at
+		the end. When delivery fails unexpectedly the remaining jobs are still
+		taken off the queue, without delivering them, so that rendering does
+		not block on a full queue.
+		'''
+		dispatcher = None
+		pending = []
+		try:
+			dispatcher = Dispatcher({output_format: self.progress.output[output_format]}, self.progress.verbose, self.progress.dryrun)
+		except Exception, e:
+			self.failures.append('%s: %s' % (output_format, e))
+		try:
+			while True:
+				item = queue.get()
+				if item is None:
+					break
+				job, subject, status = item
+				if dispatcher is None:
+					continue
+				try:
+					if subject is not None:
+						success, seconds, error = dispatcher.dispatch(job.url, subject, status)[output_format]
+						if not success:
+							self.failures.append('%s (%s): %s' % (subject, output_format, error))
+							continue
+					pending.append((job, subject is not None))
+					if len(pending) >= self.queue_size:
+						self.flush(dispatcher, output_format, pending)
+						pending = []
+				except Exception, e:
+					self.failures.append('%s %s (%s): %s' % (job.project, job.start_date, output_format, e))
+			if pending:
+				self.flush(dispatcher, output_format, pending)
+		finally:
+			if dispatcher:
+				dispatcher.close()
+
+	def flush(self, dispatcher, output_format, jobs):
+		'''
+		Flushes the queued reports of an output and records its (job,
+		delivered) pairs as done when they were delivered, jobs of windows
+		without tasks have nothing to deliver.
+		'''
+		success, seconds, error = dispatcher.flush()[output_format]
+		if not success:
+			self.failures.append('%s jobs (%s): %s' % (len(jobs), output_format, error))
+			return
+		for job, delivered in jobs:
+			self.state.add(job)
+			if delivered:
+				self.delivered += 1
+
+	def run(self):
+		jobs = [job for job in self.jobs() if not self.state.is_done(job)]
+		log.info('Backfilling %s jobs of report %s using %s processes' % (len(jobs), self.progress.name, self.processes))
+		queues = {}
+		threads = []
+		for output_format in set([job.output_format for job in jobs]):
+			queues[output_format] = Queue.Queue(self.queue_size)
+			thread = threading.Thread(target=self.deliver, args=(output_format, queues[output_format]))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+		pool = multiprocessing.Pool(self.processes, init_worker, (self.progress.tasks, self.progress.frequency, self.progress.team_statistics()))
+		try:
+			results = pool.imap(render_job, jobs)
+			for i in xrange(len(jobs)):
+				job, subject, status = results.next(RENDER_TIMEOUT)
+				queues[job.output_format].put((job, subject, status))
+			pool.close()
+		finally:
+			pool.terminate()
+			for queue in queues.itervalues():
+				queue.put(None)
+			for thread in threads:
+				thread.join()
+		log.info('Backfilled %s reports of report %s' % (self.delivered, self.progress.name))
+		if self.failures:
+			raise Exception('Could not deliver all reports:\n%s' % '\n'.join(self.failures))
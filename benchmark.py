@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import resource
+import tempfile
+import shutil
+import smtpd
+import urlparse
+import asyncore
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+import pyasana
+
+from cStringIO import StringIO
+from datetime import date, timedelta
+from report import Report
+from sender import Email, Wiki, SMTPSession, close_sessions
+from progress import Progress
+from taskstore import TaskStore, TaskRecord
+from statistics import TeamStatistics
+from export import TaskExport
+from bucketing import parse_timestamps
+from workload import Workload, FakeAsana, DISTRIBUTIONS
+from asana_api import TASK_FIELDS
+
+SCENARIOS = {
+	'1k': {'tasks': 1000, 'projects': 10, 'members': 10},
+	'10k': {'tasks': 10000, 'projects': 50, 'members': 25},
+	'100k': {'tasks': 100000, 'projects': 200, 'members': 50},
+	'1M': {'tasks': 1000000, 'projects': 1000, 'members': 100},
+}
+
+
+def timed(func, repeat):
+	'''
+	Returns the fastest of repeat runs of func in seconds.
+	'''
+	timings = []
+	for i in xrange(repeat):
+		start = time.time()
+		func()
+		timings.append(time.time() - start)
+	return min(timings)
+
+
+def benchmark_render(number_tasks, number_projects, repeat):
+	'''
+	Renders a report with number_tasks task lines spread over
+	number_projects projects in both output formats.
+	'''
+	end_date = date.today()
+	start_date = end_date - timedelta(weeks=1)
+	projects = {}
+	for i in xrange(number_projects):
+		project = pyasana.Project(i, 'Project %s' % i)
+		projects[project] = [TaskRecord(j, 'Task %s' % j, j % 10, 'Team member %s' % (j % 10), (i,), start_date.toordinal()) for j in xrange(i, number_tasks, number_projects)]
+	report = Report({}, start_date, end_date, {'email': {}, 'wiki': {}}, 'weekly', False, True)
+
+	def render():
+		for output_format in ('email', 'wiki'):
+			report.status = StringIO()
+			report.create_status(projects, output_format)
+	return timed(render, repeat)
+
+
+class SMTPStandIn(smtpd.SMTPServer):
+	'''
+	A local SMTP server that accepts and discards all messages and counts
+	the connections that were opened to it.
+	'''
+	def __init__(self):
+		smtpd.SMTPServer.__init__(self, ('localhost', 0), None)
+		self.port = self.socket.getsockname()[1]
+		self.connections = 0
+		self.messages = 0
+
+	def handle_accept(self):
+		self.connections += 1
+		smtpd.SMTPServer.handle_accept(self)
+
+	def process_message(self, peer, mailfrom, rcpttos, data):
+		self.messages += 1
+
+
+def benchmark_smtp(number_messages, batch_size, repeat):
+	'''
+	Emails number_messages reports through a local SMTP stand-in and
+	returns the time it took and the number of connections that were opened.
+	'''
+	server = SMTPStandIn()
+	thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.01})
+	thread.daemon = True
+	thread.start()
+	settings = {
+		'server': {'host': 'localhost', 'port': server.port, 'batch_size': batch_size},
+		'sender': {'name': 'asana-stats', 'email': 'asana-stats@localhost'},
+		'recipients': ['team@localhost'],
+		'projects': {},
+	}
+
+	def send():
+		for i in xrange(number_messages):
+			email = Email(subject='Report %s' % i, status=StringIO('* Task %s' % i), verbose=False, dryrun=False, **settings)
+			email.send(None)
+		SMTPSession.close_all()
+	seconds = timed(send, repeat)
+	asyncore.close_all()
+	thread.join()
+	return seconds, server.connections / repeat
+
+
+class FakeMediaWikiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	'''
+	Answers the subset of the MediaWiki API that sender.Wiki uses: login,
+	edit tokens, revision queries and edits. Every request takes latency
+	seconds and the first lagged edits are refused with a maxlag error.
+	While expired is set edits are refused as if the session had expired,
+	until the next login.
+	'''
+	def log_message(self, *args):
+		pass
+
+	def do_POST(self):
+		server = self.server
+		params = dict(urlparse.parse_qsl(self.rfile.read(int(self.headers.get('content-length', 0)))))
+		time.sleep(server.latency)
+		headers = {}
+		action = params.get('action')
+		if action == 'login':
+			if 'lgtoken' in params:
+				with server.lock:
+					server.logins += 1
+					server.expired = False
+				result = {'login': {'result': 'Success'}}
+				headers['Set-Cookie'] = 'session=fake; Path=/'
+			else:
+				result = {'login': {'result': 'NeedToken', 'token': 'logintoken'}}
+		elif action == 'query' and params.get('intoken') == 'edit':
+			pages = dict([(str(-i), {'title': title, 'edittoken': 'edittoken'}) for i, title in enumerate(params['titles'].split('|'))])
+			result = {'query': {'pages': pages}}
+		elif action == 'query':
+			result = {'query': {'pages': {'1': {'title': params['titles'], 'revisions': []}}}}
+		elif action == 'edit' and server.expired:
+			result = {'error': {'code': 'assertuserfailed', 'info': 'Assertion that the user is logged in failed'}}
+		elif action == 'edit':
+			with server.lock:
+				lagged = server.lagged > 0
+				server.lagged -= 1
+				server.edits += 1
+			if lagged:
+				result = {'error': {'code': 'maxlag', 'info': 'Waiting for a database server'}}
+				headers['Retry-After'] = '0'
+			else:
+				result = {'edit': {'result': 'Success', 'title': params['title'], 'newrevid': server.edits}}
+		else:
+			result = {'error': {'code': 'unknown_action'}}
+		body = json.dumps(result)
+		self.send_response(200)
+		for key, value in headers.iteritems():
+			self.send_header(key, value)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class FakeMediaWiki(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, latency, lagged):
+		BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), FakeMediaWikiHandler)
+		self.latency = latency
+		self.lagged = lagged
+		self.edits = 0
+		self.logins = 0
+		self.expired = False
+		self.lock = threading.Lock()
+		self.url = 'http://localhost:%s/w/api.php' % self.server_address[1]
+
+
+def benchmark_wiki(number_titles, concurrency, latency, lagged):
+	'''
+	Publishes a report to number_titles pages of a fake MediaWiki API and
+	returns the total time and the (title, success, seconds, error) result of
+	every edit.
+	'''
+	server = FakeMediaWiki(latency, lagged)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	titles = dict([('Project %s' % i, 'Status/Project %s' % i) for i in xrange(number_titles)])
+	start = time.time()
+	for title in titles.itervalues():
+		wiki = Wiki('user', 'secret', server.url, titles, 'Weekly update', StringIO('* Task'), False, False, edits_per_minute=None, concurrency=concurrency)
+		wiki.send(title)
+	session = wiki.session
+	close_sessions()
+	seconds = time.time() - start
+	server.shutdown()
+	results = session.publisher.results
+	if not results:
+		results = [(title, True, None, None) for title in titles.itervalues()]
+	return seconds, results
+
+
+def benchmark_pipeline(workload, latency, page_size, workers, concurrency, number_reports, frequency, quota=None, quota_window=60, requests_per_minute=None, max_requests_per_minute=None, stream=False, crawl='projects'):
+	'''
+	Runs the stages of a report against a fake Asana API serving workload
+	and returns the seconds every stage took: crawling Asana, bucketing the
+	tasks into the report windows, rendering the statuses and delivering
+	them as dry runs to email and to a fake MediaWiki API. The fake API
+	throttles requests beyond quota per quota_window seconds, requests are
+	only scheduled when requests_per_minute is given. With stream the tasks
+	are bucketed as they are paged in, as asana-stats does, and crawling
+	and bucketing are timed together. crawl is the crawl strategy.
+	'''
+	asana = FakeAsana(workload, latency, page_size, quota, quota_window).start()
+	wiki = FakeMediaWiki(0, 0)
+	thread = threading.Thread(target=wiki.serve_forever)
+	thread.daemon = True
+	thread.start()
+	output = {
+		'email': {'server': {'host': 'localhost', 'port': 25}, 'sender': {'name': 'asana-stats', 'email': 'asana-stats@localhost'}, 'recipients': ['team@localhost'], 'projects': {'All': 'Status'}},
+		'wiki': {'username': 'user', 'password': 'secret', 'url': wiki.url, 'projects': {'All': 'Status'}, 'edits_per_minute': None},
+	}
+	args = argparse.Namespace(verbose=False, dry_run=True, number_reports=number_reports, workers=workers, hydrate=False, refresh=False, record=None, replay=None)
+	progress = Progress('benchmark', frequency, [], workload.team_members, output, 'w', 'key', args, concurrency=concurrency, requests_per_minute=requests_per_minute or -1, max_requests_per_minute=max_requests_per_minute, crawl=crawl)
+	# Progress always runs as a dry run, which only crawls the first four projects
+	progress.dryrun = False
+	progress.api.API_BASE = asana.url
+	progress.api.page_size = page_size
+	stages = {}
+	try:
+		if stream:
+			start = time.time()
+			progress.run()
+			stages['stream'] = time.time() - start
+		else:
+			start = time.time()
+			snapshot = progress.crawl()
+			stages['crawl'] = time.time() - start
+
+			start = time.time()
+			progress.run(snapshot)
+			stages['bucket'] = time.time() - start
+
+		report = Report(progress.tasks, progress.start_date, progress.end_date, output, frequency, False, True)
+		start = time.time()
+		for output_format in output:
+			for window in progress.tasks.windows():
+				report.status = StringIO()
+				report.create_status(progress.tasks.group_by_project(window), output_format)
+		stages['render'] = time.time() - start
+
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			start = time.time()
+			report.create_statuses()
+			close_sessions()
+			stages['deliver'] = time.time() - start
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+	finally:
+		asana.shutdown()
+		wiki.shutdown()
+	return {
+		'stages': stages,
+		'seconds': sum(stages.values()),
+		'requests': asana.requests,
+		'throttled': asana.throttled,
+		'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		'reported_tasks': len(progress.tasks.find()),
+	}
+
+
+def resident_memory():
+	'''
+	Returns the resident memory of the process in bytes, only on Linux.
+	'''
+	fh = open('/proc/self/statm')
+	pages = int(fh.read().split()[1])
+	fh.close()
+	return pages * resource.getpagesize()
+
+
+def memory_growth(build):
+	'''
+	Returns by how many bytes the resident memory grows while the objects
+	that build returns are alive.
+	'''
+	before = resident_memory()
+	objects = build()
+	growth = resident_memory() - before
+	# the objects are only released once their memory has been measured
+	del objects
+	return growth
+
+
+def measure_memory(build):
+	'''
+	Runs build in a forked process and returns by how many bytes the
+	resident memory grew while the objects it returns were alive, a fresh
+	process keeps the measurements of different builds apart.
+	'''
+	read, write = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read)
+		os.write(write, str(memory_growth(build)))
+		os._exit(0)
+	os.close(write)
+	result = int(os.read(read, 64))
+	os.close(read)
+	os.waitpid(pid, 0)
+	return result
+
+
+def benchmark_memory(number_tasks, number_members):
+	'''
+	Compares the memory that number_tasks completed tasks take as pyasana
+	Tasks, with their completed_at parsed into a date as asana-stats used
+	to keep them, and as TaskRecords.
+	'''
+	workload = Workload(number_projects=1, number_tasks=number_tasks, number_members=number_members, completed=1.0)
+	data = [workload.task_json(task, TASK_FIELDS) for task in workload.tasks.values()[0]]
+	completed_dates = parse_timestamps([task['completed_at'] for task in data])
+
+	def build_tasks():
+		tasks = [pyasana.Task.new_from_json(task) for task in data]
+		for task, completed_date in zip(tasks, completed_dates):
+			task.completed_at = completed_date
+		return tasks
+
+	def build_records():
+		return [TaskRecord.from_task(pyasana.Task.new_from_json(task), completed_date, (1,)) for task, completed_date in zip(data, completed_dates)]
+
+	return measure_memory(build_tasks), measure_memory(build_records)
+
+
+def build_store(number_tasks, number_projects, number_members, days):
+	'''
+	Returns a TaskStore with number_tasks tasks completed over the last days
+	days, bucketed into weekly windows, and the start dates of the windows.
+	'''
+	end_date = date.today()
+	first_window = end_date - timedelta(days=days + end_date.weekday())
+	windows = [first_window + timedelta(weeks=i) for i in xrange(days / 7 + 2)]
+	projects = [pyasana.Project(i, 'Project %s' % i) for i in xrange(number_projects)]
+	store = TaskStore()
+	for window in windows:
+		store.add_window(window)
+	for i in xrange(number_tasks):
+		completed_on = end_date - timedelta(days=(i * 7919) % days)
+		window = windows[(completed_on - first_window).days / 7]
+		store.add(window, 'Workspace', projects[i % number_projects], TaskRecord(i, 'Task %s' % i, i % number_members, 'Team member %s' % (i % number_members), (i % number_projects,), completed_on.toordinal()))
+	return store, windows
+
+
+def benchmark_statistics(number_tasks, number_projects, number_members, days, repeat):
+	'''
+	Computes the statistics of every weekly window over number_tasks tasks
+	completed over the last days days, once with TeamStatistics and once
+	by counting the tasks of every window in Python.
+	'''
+	store, windows = build_store(number_tasks, number_projects, number_members, days)
+
+	def vectorised():
+		statistics = TeamStatistics.from_store(store)
+		return [statistics.summary(window) for window in windows]
+
+	def counted():
+		summaries = []
+		for window in windows:
+			members, projects = {}, {}
+			for record in store.find(window=window):
+				members[record.task.assignee] = members.get(record.task.assignee, 0) + 1
+				projects[record.project.name] = projects.get(record.project.name, 0) + 1
+			summaries.append((members, projects))
+		return summaries
+	return timed(vectorised, repeat), timed(counted, repeat), len(windows)
+
+
+def benchmark_export(number_tasks, number_projects, number_members, days, repeat):
+	'''
+	Exports number_tasks tasks both as a TaskExport and as a CSV file, and
+	times selecting the tasks of one member in the last window and in all
+	windows from each of them.
+	'''
+	store, windows = build_store(number_tasks, number_projects, number_members, days)
+	path = tempfile.mkdtemp()
+	try:
+		export_path = os.path.join(path, 'export')
+		csv_path = os.path.join(path, 'tasks.csv')
+		start = time.time()
+		TaskExport(export_path).append(store)
+		append_seconds = time.time() - start
+		fh = open(csv_path, 'wb')
+		writer = csv.writer(fh)
+		writer.writerow(['window', 'workspace', 'project', 'assignee', 'id', 'name', 'completed_date'])
+		for task in TaskExport(export_path).tasks():
+			writer.writerow([task.window, task.workspace, task.project, task.assignee, task.id, task.name.encode('utf-8'), task.completed_date])
+		fh.close()
+		member = 'Team member 0'
+		window = str(windows[-2])
+
+		def read_export():
+			export = TaskExport(export_path)
+			return len(export.tasks(window=windows[-2], member=member)), len(export.select(member=member))
+
+		def read_csv():
+			fh = open(csv_path, 'rb')
+			rows = [row for row in csv.reader(fh)][1:]
+			fh.close()
+			return len([row for row in rows if row[0] == window and row[3] == member]), len([row for row in rows if row[3] == member])
+		assert read_export() == read_csv()
+		sizes = (sum([os.path.getsize(os.path.join(export_path, name)) for name in os.listdir(export_path)]), os.path.getsize(csv_path))
+		return append_seconds, timed(read_export, repeat), timed(read_csv, repeat), sizes
+	finally:
+		shutil.rmtree(path)
+
+
+def parse_commandline():
+	parser = argparse.ArgumentParser(description='Benchmarks for asana-stats.')
+	parser.add_argument('benchmark', help='The benchmark to run.', choices=['render', 'smtp', 'wiki', 'pipeline', 'memory', 'statistics', 'export'])
+	parser.add_argument('--tasks', help='Number of task lines in the rendered report, or of tasks in the Asana workload.', type=int)
+	parser.add_argument('--projects', help='Number of projects the tasks are spread over.', type=int)
+	parser.add_argument('--messages', help='Number of reports that are emailed.', default=50, type=int)
+	parser.add_argument('--batch_size', help='Number of emails that are queued before they are sent.', default=20, type=int)
+	parser.add_argument('--titles', help='Number of wiki pages that are published to.', default=20, type=int)
+	parser.add_argument('--concurrency', help='Number of wiki pages that are published to concurrently.', default=4, type=int)
+	parser.add_argument('--latency', help='Seconds that the fake MediaWiki API takes to answer a request.', default=0.05, type=float)
+	parser.add_argument('--lagged', help='Number of edits that the fake MediaWiki API refuses with a maxlag error.', default=0, type=int)
+	parser.add_argument('--scenario', help='Size of the synthetic Asana workload of the pipeline benchmark, --tasks, --projects and --members override it.', choices=sorted(SCENARIOS.keys()), default='1k')
+	parser.add_argument('--members', help='Number of people that tasks are assigned to, half of them are team members.', type=int)
+	parser.add_argument('--days', help='Number of days over which the tasks were completed.', default=365, type=int)
+	parser.add_argument('--distribution', help='How the completion dates of tasks are spread over the days.', choices=DISTRIBUTIONS, default='uniform')
+	parser.add_argument('--seed', help='Seed of the synthetic Asana workload.', default=0, type=int)
+	parser.add_argument('--quota', help='Number of requests per --quota_window seconds after which the fake Asana API responds with 429.', type=int)
+	parser.add_argument('--quota_window', help='Seconds over which the quota of the fake Asana API is counted.', default=60, type=float)
+	parser.add_argument('--requests_per_minute', help='Rate at which the Asana requests are scheduled, requests are not scheduled by default.', type=int)
+	parser.add_argument('--max_requests_per_minute', help='Rate up to which the scheduler raises --requests_per_minute while Asana does not throttle.', type=int)
+	parser.add_argument('--stream', help='Bucket the tasks of the pipeline benchmark as they are paged in instead of after the crawl.', default=False, action='store_true')
+	parser.add_argument('--crawl', help='Crawl strategy of the pipeline benchmark.', choices=['projects', 'assignees', 'auto'], default='projects')
+	parser.add_argument('--page_size', help='Maximum number of tasks the fake Asana API returns per page.', default=100, type=int)
+	parser.add_argument('--workers', help='Number of threads that fetch tasks concurrently.', default=1, type=int)
+	parser.add_argument('--number_reports', help='Number of report windows.', default=52, type=int)
+	parser.add_argument('--frequency', help='Frequency of the reports.', choices=['weekly', 'monthly'], default='weekly')
+	parser.add_argument('--output', help='File to which the results are written as JSON.')
+	parser.add_argument('--repeat', help='Number of times each benchmark is run, the fastest run is reported.', default=3, type=int)
+	return parser.parse_args()
+
+
+def main():
+	args = parse_commandline()
+	results = {'benchmark': args.benchmark, 'date': str(date.today())}
+	if args.benchmark == 'render':
+		args.tasks = args.tasks or 100000
+		args.projects = args.projects or 10
+		seconds = benchmark_render(args.tasks, args.projects, args.repeat)
+		results.update({'tasks': args.tasks, 'projects': args.projects, 'seconds': seconds})
+		print 'render: %s task lines in %s projects took %.3fs' % (args.tasks, args.projects, seconds)
+	elif args.benchmark == 'smtp':
+		seconds, connections = benchmark_smtp(args.messages, args.batch_size, args.repeat)
+		results.update({'messages': args.messages, 'batch_size': args.batch_size, 'connections': connections, 'seconds': seconds})
+		print 'smtp: %s messages over %s connection(s) took %.3fs' % (args.messages, connections, seconds)
+	elif args.benchmark == 'wiki':
+		seconds, edits = benchmark_wiki(args.titles, args.concurrency, args.latency, args.lagged)
+		for title, success, title_seconds, error in sorted(edits):
+			print '%s: %s %s' % (title, 'ok' if success else error, '%.3fs' % title_seconds if title_seconds is not None else '')
+		results.update({'titles': args.titles, 'concurrency': args.concurrency, 'latency': args.latency, 'lagged': args.lagged, 'seconds': seconds,
+			'edits': [{'title': title, 'success': success, 'seconds': title_seconds, 'error': error and str(error)} for title, success, title_seconds, error in sorted(edits)]})
+		print 'wiki: %s titles with concurrency %s took %.3fs' % (args.titles, args.concurrency, seconds)
+	elif args.benchmark == 'pipeline':
+		logging.getLogger().setLevel(logging.WARNING)
+		scenario = SCENARIOS[args.scenario]
+		parameters = {
+			'scenario': args.scenario,
+			'tasks': args.tasks or scenario['tasks'],
+			'projects': args.projects or scenario['projects'],
+			'members': args.members or scenario['members'],
+			'days': args.days,
+			'distribution': args.distribution,
+			'seed': args.seed,
+			'latency': args.latency,
+			'page_size': args.page_size,
+			'quota': args.quota,
+			'quota_window': args.quota_window,
+			'requests_per_minute': args.requests_per_minute,
+			'max_requests_per_minute': args.max_requests_per_minute,
+			'stream': args.stream,
+			'crawl': args.crawl,
+			'workers': args.workers,
+			'concurrency': args.concurrency,
+			'number_reports': args.number_reports,
+			'frequency': args.frequency,
+		}
+		start = time.time()
+		workload = Workload(number_projects=parameters['projects'], number_tasks=parameters['tasks'], number_members=parameters['members'], days=args.days, distribution=args.distribution, seed=args.seed)
+		results['generate'] = time.time() - start
+		results.update(parameters)
+		results.update(benchmark_pipeline(workload, args.latency, args.page_size, args.workers, args.concurrency, args.number_reports, args.frequency, args.quota, args.quota_window, args.requests_per_minute, args.max_requests_per_minute, args.stream, args.crawl))
+		for stage in ('crawl', 'bucket', 'stream', 'render', 'deliver'):
+			if stage in results['stages']:
+				print '%s: %.3fs' % (stage, results['stages'][stage])
+		print 'pipeline: %s tasks in %s projects, %s requests (%s throttled), %s tasks reported, took %.3fs, peak memory %sMB' % (parameters['tasks'], parameters['projects'], results['requests'], results['throttled'], results['reported_tasks'], results['seconds'], results['max_rss'] / 1024)
+	elif args.benchmark == 'memory':
+		args.tasks = args.tasks or 100000
+		args.members = args.members or 50
+		tasks, records = benchmark_memory(args.tasks, args.members)
+		results.update({'tasks': args.tasks, 'members': args.members, 'pyasana_bytes': tasks, 'record_bytes': records})
+		print 'memory: %s tasks take %.1fMB as pyasana Tasks and %.1fMB as TaskRecords (%.0f and %.0f bytes per task)' % (args.tasks, tasks / 1048576.0, records / 1048576.0, float(tasks) / args.tasks, float(records) / args.tasks)
+	elif args.benchmark == 'statistics':
+		args.tasks = args.tasks or 500000
+		args.projects = args.projects or 200
+		args.members = args.members or 50
+		args.days = max(args.days, 7)
+		vectorised, counted, windows = benchmark_statistics(args.tasks, args.projects, args.members, args.days, args.repeat)
+		results.update({'tasks': args.tasks, 'projects': args.projects, 'members': args.members, 'days': args.days, 'windows': windows, 'vectorised_seconds': vectorised, 'counted_seconds': counted})
+		print 'statistics: %s tasks over %s windows took %.3fs with TeamStatistics and %.3fs counted in Python' % (args.tasks, windows, vectorised, counted)
+	elif args.benchmark == 'export':
+		args.tasks = args.tasks or 500000
+		args.projects = args.projects or 200
+		args.members = args.members or 50
+		args.days = max(args.days, 7)
+		append, export, csv_seconds, (export_bytes, csv_bytes) = benchmark_export(args.tasks, args.projects, args.members, args.days, args.repeat)
+		results.update({'tasks': args.tasks, 'projects': args.projects, 'members': args.members, 'days': args.days, 'append_seconds': append, 'export_seconds': export, 'csv_seconds': csv_seconds, 'export_bytes': export_bytes, 'csv_bytes': csv_bytes})
+		print 'export: appending %s tasks took %.3fs, selecting a member took %.3fs from the export (%.1fMB) and %.3fs from CSV (%.1fMB)' % (args.tasks, append, export, export_bytes / 1048576.0, csv_seconds, csv_bytes / 1048576.0)
+	if args.output:
+		fh = open(args.output, 'w')
+		json.dump(results, fh, indent=2, sort_keys=True)
+		fh.close()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import re
+import bisect
+from datetime import datetime, timedelta, date
+
+UTC_SUFFIXES = frozenset(['', 'Z', '+00:00', '-00:00', '+0000', '-0000'])
+# an offset of hours and optional minutes: +05, +0530 or +05:30
+OFFSET = re.compile(r'^([+-])(\d{2})(?::?(\d{2}))?$')
+
+
+def parse_timestamp(timestamp):
+	'''
+	Parses an ISO 8601 timestamp as returned by Asana, for example
+	2012-10-01T14:01:23.123Z, into the date on which it falls in UTC. The
+	fields are sliced from their fixed positions instead of going through
+	strptime, timestamps with an offset other than UTC are converted first.
+	'''
+	obs_date = date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]))
+	suffix = timestamp[19:].lstrip('.0123456789')
+	if suffix in UTC_SUFFIXES:
+		return obs_date
+	match = OFFSET.match(suffix)
+	if match is None:
+		raise ValueError('Timestamp %s has an unsupported offset.' % timestamp)
+	sign, hours, minutes = match.groups()
+	offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+	if sign == '-':
+		offset = -offset
+	obs_datetime = datetime(obs_date.year, obs_date.month, obs_date.day, int(timestamp[11:13]), int(timestamp[14:16]))
+	return (obs_datetime - offset).date()
+
+
+def parse_timestamps(timestamps):
+	'''
+	Parses a list of timestamps at once, UTC timestamps that fall on the
+	same day are only parsed once.
+	'''
+	dates = {}
+	results = []
+	for timestamp in timestamps:
+		if timestamp[19:].lstrip('.0123456789') not in UTC_SUFFIXES:
+			results.append(parse_timestamp(timestamp))
+			continue
+		day = timestamp[:10]
+		obs_date = dates.get(day)
+		if obs_date is None:
+			obs_date = dates[day] = parse_timestamp(timestamp)
+		results.append(obs_date)
+	return results
+
+
+class Buckets(object):
+	'''
+	Assigns dates to report windows. The windows are (start_date, end_date)
+	tuples where end_date is exclusive, they are sorted once so that finding
+	the window of a date is a binary search over the start dates.
+	'''
+	def __init__(self, windows):
+		windows = sorted(windows)
+		self.starts = [start_date for start_date, end_date in windows]
+		self.ends = [end_date for start_date, end_date in windows]
+		self.start_days = [start_date.toordinal() for start_date in self.starts]
+		self.end_days = [end_date.toordinal() for end_date in self.ends]
+
+	def bucket(self, obs_date):
+		'''
+		Returns the start date of the window that contains obs_date, or None
+		when obs_date does not fall in any window.
+		'''
+		i = bisect.bisect_right(self.starts, obs_date) - 1
+		if i >= 0 and obs_date < self.ends[i]:
+			return self.starts[i]
+		else:
+			return None
+
+	def bucket_dates(self, dates):
+		bucket = self.bucket
+		return [bucket(obs_date) for obs_date in dates]
+
+	def bucket_days(self, days):
+		'''
+		Like bucket_dates for day numbers as returned by date.toordinal.
+		'''
+		starts, start_days, end_days = self.starts, self.start_days, self.end_days
+		results = []
+		for day in days:
+			i = bisect.bisect_right(start_days, day) - 1
+			results.append(starts[i] if i >= 0 and day < end_days[i] else None)
+		return results
+
+	def bucket_timestamps(self, timestamps):
+		return self.bucket_dates(parse_timestamps(timestamps))
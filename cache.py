@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import pyasana
+
+log = logging.getLogger()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS workspaces (
+	id INTEGER PRIMARY KEY,
+	name TEXT,
+	fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS projects (
+	id INTEGER PRIMARY KEY,
+	workspace_id INTEGER,
+	name TEXT,
+	fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+	id INTEGER,
+	project_id INTEGER,
+	modified_at TEXT,
+	completed_at TEXT,
+	data TEXT,
+	fetched_at REAL,
+	PRIMARY KEY (id, project_id)
+);
+CREATE INDEX IF NOT EXISTS tasks_project ON tasks (project_id);
+CREATE TABLE IF NOT EXISTS sync (
+	project_id INTEGER PRIMARY KEY,
+	workspace_id INTEGER,
+	completed_since TEXT,
+	modified_since TEXT,
+	synced_at REAL,
+	reconciled_at REAL
+);
+'''
+
+
+def task_to_json(task):
+	data = {
+		'id': task.id,
+		'name': task.name,
+		'completed': task.completed,
+		'completed_at': task.completed_at,
+		'modified_at': task.modified_at,
+	}
+	if task.assignee:
+		data['assignee'] = {'id': task.assignee.id, 'name': task.assignee.name}
+	return data
+
+
+class Cache(object):
+	'''
+	Keeps the workspaces, projects and tasks that have been fetched from Asana
+	in a SQLite database so that the next run only has to go to the network
+	for things that have changed. Listings expire after max_age seconds, tasks
+	are refetched whenever their modified_at timestamp changes and the sync
+	table keeps the high-water mark of every project for incremental syncs.
+	'''
+	def __init__(self, cache_dir, max_age=86400, refresh=False):
+		cache_dir = os.path.expanduser(cache_dir)
+		if not os.path.exists(cache_dir):
+			os.makedirs(cache_dir)
+		self.path = os.path.join(cache_dir, 'asana-stats.sqlite')
+		self.max_age = max_age
+		self.refresh = refresh
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		self.db.executescript(SCHEMA)
+		log.info('Using cache %s' % self.path)
+
+	def is_fresh(self, fetched_at):
+		return not self.refresh and fetched_at is not None and time.time() - fetched_at < self.max_age
+
+	def get_workspaces(self):
+		with self.lock:
+			rows = self.db.execute('SELECT id, name, fetched_at FROM workspaces ORDER BY rowid').fetchall()
+		if rows and all([self.is_fresh(row[2]) for row in rows]):
+			return [pyasana.Workspace(row[0], row[1]) for row in rows]
+		return None
+
+	def set_workspaces(self, workspaces):
+		now = time.time()
+		with self.lock:
+			with self.db:
+				self.db.execute('DELETE FROM workspaces')
+				self.db.executemany('INSERT INTO workspaces (id, name, fetched_at) VALUES (?, ?, ?)', [(workspace.id, workspace.name, now) for workspace in workspaces])
+
+	def get_projects(self, workspace_id):
+		with self.lock:
+			rows = self.db.execute('SELECT id, name, fetched_at FROM projects WHERE workspace_id = ? ORDER BY rowid', (workspace_id,)).fetchall()
+		if rows and all([self.is_fresh(row[2]) for row in rows]):
+			return [pyasana.Project(row[0], row[1]) for row in rows]
+		return None
+
+	def set_projects(self, workspace_id, projects):
+		now = time.time()
+		project_ids = [project.id for project in projects]
+		with self.lock:
+			with self.db:
+				removed = [row[0] for row in self.db.execute('SELECT id FROM projects WHERE workspace_id = ?', (workspace_id,)) if row[0] not in project_ids]
+				self.db.executemany('DELETE FROM tasks WHERE project_id = ?', [(project_id,) for project_id in removed])
+				self.db.execute('DELETE FROM projects WHERE workspace_id = ?', (workspace_id,))
+				self.db.executemany('INSERT OR REPLACE INTO projects (id, workspace_id, name, fetched_at) VALUES (?, ?, ?, ?)', [(project.id, workspace_id, project.name, now) for project in projects])
+
+	def get_tasks(self, project_id, completed_since=None):
+		'''
+		Returns a dictionary of task id to (modified_at, task) for all the
+		cached tasks of a project, or only for the tasks that are open or
+		that were completed since completed_since (an ISO 8601 date).
+		'''
+		with self.lock:
+			if completed_since:
+				rows = self.db.execute('SELECT id, modified_at, data FROM tasks WHERE project_id = ? AND (completed_at IS NULL OR completed_at >= ?)', (project_id, completed_since)).fetchall()
+			else:
+				rows = self.db.execute('SELECT id, modified_at, data FROM tasks WHERE project_id = ?', (project_id,)).fetchall()
+		return dict([(row[0], (row[1], pyasana.Task.new_from_json(json.loads(row[2])))) for row in rows])
+
+	def set_tasks(self, project_id, tasks):
+		now = time.time()
+		with self.lock:
+			with self.db:
+				self.db.executemany('INSERT OR REPLACE INTO tasks (id, project_id, modified_at, completed_at, data, fetched_at) VALUES (?, ?, ?, ?, ?, ?)', [(task.id, project_id, task.modified_at, task.completed_at, json.dumps(task_to_json(task)), now) for task in tasks])
+
+	def remove_tasks(self, project_id, task_ids):
+		with self.lock:
+			with self.db:
+				self.db.executemany('DELETE FROM tasks WHERE id = ? AND project_id = ?', [(task_id, project_id) for task_id in task_ids])
+
+	def get_task_ids(self, project_id, completed_since):
+		'''
+		Returns the ids of the cached tasks of a project that are open or that
+		were completed since completed_since (an ISO 8601 date).
+		'''
+		with self.lock:
+			rows = self.db.execute('SELECT id FROM tasks WHERE project_id = ? AND (completed_at IS NULL OR completed_at >= ?)', (project_id, completed_since)).fetchall()
+		return set([row[0] for row in rows])
+
+	def prune_tasks(self, project_id, completed_before):
+		'''
+		Removes the tasks of a project that were completed before
+		completed_before (an ISO 8601 date), no report window covers them.
+		'''
+		with self.lock:
+			with self.db:
+				cursor = self.db.execute('DELETE FROM tasks WHERE project_id = ? AND completed_at < ?', (project_id, completed_before))
+		return cursor.rowcount
+
+	def clear_tasks(self, project_id):
+		with self.lock:
+			with self.db:
+				self.db.execute('DELETE FROM tasks WHERE project_id = ?', (project_id,))
+
+	def get_sync(self, project_id):
+		'''
+		Returns the (completed_since, modified_since, reconciled_at) high-water
+		mark of the last successful sync of a project, or None if it has never
+		been synced.
+		'''
+		if self.refresh:
+			return None
+		with self.lock:
+			return self.db.execute('SELECT completed_since, modified_since, reconciled_at FROM sync WHERE project_id = ?', (project_id,)).fetchone()
+
+	def set_sync(self, workspace_id, project_id, completed_since, modified_since, reconciled_at=None):
+		'''
+		Records a successful sync, reconciled_at is when the tasks of the
+		project were last checked against a full listing.
+		'''
+		with self.lock:
+			with self.db:
+				self.db.execute('INSERT OR REPLACE INTO sync (project_id, workspace_id, completed_since, modified_since, synced_at, reconciled_at) VALUES (?, ?, ?, ?, ?, ?)', (project_id, workspace_id, completed_since, modified_since, time.time(), reconciled_at))
+
+	def evict(self, max_age):
+		'''
+		Removes the tasks of projects that have not been synced for max_age
+		seconds, these projects have been deleted or are no longer crawled.
+		'''
+		with self.lock:
+			with self.db:
+				self.db.execute('DELETE FROM sync WHERE synced_at < ?', (time.time() - max_age,))
+				cursor = self.db.execute('DELETE FROM tasks WHERE project_id NOT IN (SELECT project_id FROM sync)')
+		if cursor.rowcount:
+			log.info('Evicted %s stale tasks from cache' % cursor.rowcount)
+
+	def close(self):
+		with self.lock:
+			self.db.close()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import json
+import logging
+import numpy
+
+from collections import namedtuple
+from datetime import date
+
+log = logging.getLogger()
+
+VERSION = 1
+
+# The columns of an export, each is kept in its own file of fixed-width
+# little-endian values so that a reader only maps the columns it uses.
+# window and completed_on are day numbers (date.toordinal), workspace,
+# project and member index the string tables in the header and the name of
+# a task is name_length bytes of UTF-8 at name_offset in names.bin.
+COLUMNS = [
+	('id', '<i8'),
+	('window', '<i4'),
+	('completed_on', '<i4'),
+	('workspace', '<i4'),
+	('project', '<i4'),
+	('member', '<i4'),
+	('assignee_id', '<i8'),
+	('name_offset', '<i8'),
+	('name_length', '<i4'),
+]
+
+ExportedTask = namedtuple('ExportedTask', ['window', 'workspace', 'project', 'assignee', 'id', 'name', 'completed_date'])
+
+
+class TaskExport(object):
+	'''
+	The completed tasks of a report as a directory of column files, a heap
+	with the task names and header.json with the number of rows, the string
+	tables and the rows of every window. Every append adds the windows that
+	are not in the export yet after the existing rows and then replaces the
+	header, so a reader or an interrupted append never sees a partial
+	window. Columns are memory-mapped, selecting a window only touches its
+	rows and selecting a member only reads the member column.
+	'''
+	def __init__(self, path):
+		self.path = os.path.expanduser(path)
+		self.header = {
+			'version': VERSION,
+			'rows': 0,
+			'name_bytes': 0,
+			'columns': COLUMNS,
+			'workspaces': [],
+			'projects': [],
+			'members': [],
+			'windows': [],
+		}
+		self.columns = {}
+		if os.path.exists(self.filename('header.json')):
+			fh = open(self.filename('header.json'), 'r')
+			self.header = json.load(fh)
+			fh.close()
+			if self.header['version'] != VERSION:
+				raise Exception('Export %s has version %s, only version %s can be read.' % (self.path, self.header['version'], VERSION))
+		self.windows = dict([(ordinal, (start, stop)) for ordinal, start, stop in self.header['windows']])
+
+	def __len__(self):
+		return self.header['rows']
+
+	def filename(self, name):
+		return os.path.join(self.path, name)
+
+	def append(self, store):
+		'''
+		Appends the windows of a TaskStore that are not in the export yet and
+		returns the number of tasks that were added.
+		'''
+		windows = [window for window in store.windows() if window.toordinal() not in self.windows]
+		if not windows:
+			return 0
+		if not os.path.exists(self.path):
+			os.makedirs(self.path)
+		tables = dict([(table, dict([(self.key(table, value), i) for i, value in enumerate(self.header[table])])) for table in ('workspaces', 'projects', 'members')])
+		rows = dict([(name, []) for name, dtype in COLUMNS])
+		names = []
+		row = self.header['rows']
+		name_offset = self.header['name_bytes']
+		for window in windows:
+			start = row
+			for record in store.find(window=window):
+				task = record.task
+				name = (task.name or u'').encode('utf-8')
+				rows['id'].append(task.id)
+				rows['window'].append(window.toordinal())
+				rows['completed_on'].append(task.completed_on)
+				rows['workspace'].append(self.lookup(tables, 'workspaces', record.workspace))
+				rows['project'].append(self.lookup(tables, 'projects', [record.project.id, record.project.name]))
+				rows['member'].append(self.lookup(tables, 'members', task.assignee))
+				rows['assignee_id'].append(task.assignee_id if task.assignee_id is not None else -1)
+				rows['name_offset'].append(name_offset)
+				rows['name_length'].append(len(name))
+				names.append(name)
+				name_offset += len(name)
+				row += 1
+			self.header['windows'].append([window.toordinal(), start, row])
+		for name, dtype in COLUMNS:
+			self.write(name, self.header['rows'] * numpy.dtype(dtype).itemsize, numpy.array(rows[name], dtype=dtype).tobytes())
+		self.write('names', self.header['name_bytes'], ''.join(names))
+		added = row - self.header['rows']
+		self.header['rows'] = row
+		self.header['name_bytes'] = name_offset
+		self.save()
+		log.info('Exported %s tasks in %s windows to %s' % (added, len(windows), self.path))
+		return added
+
+	def key(self, table, value):
+		return tuple(value) if table == 'projects' else value
+
+	def lookup(self, tables, table, value):
+		key = self.key(table, value)
+		if key not in tables[table]:
+			tables[table][key] = len(self.header[table])
+			self.header[table].append(value)
+		return tables[table][key]
+
+	def write(self, name, size, data):
+		'''
+		Appends data to a column file after its first size bytes, anything
+		beyond them was left behind by an interrupted append.
+		'''
+		path = self.filename('%s.bin' % name)
+		fh = open(path, 'r+b' if os.path.exists(path) else 'wb')
+		fh.truncate(size)
+		fh.seek(size)
+		fh.write(data)
+		fh.close()
+
+	def save(self):
+		path = self.filename('header.json')
+		fh = open('%s.tmp' % path, 'w')
+		json.dump(self.header, fh)
+		fh.close()
+		os.rename('%s.tmp' % path, path)
+		self.windows = dict([(ordinal, (start, stop)) for ordinal, start, stop in self.header['windows']])
+		self.columns = {}
+
+	def column(self, name):
+		'''
+		Returns a column as a read-only memory-mapped array.
+		'''
+		if name not in self.columns:
+			dtype = numpy.dtype(dict(COLUMNS)[name]) if name != 'names' else numpy.uint8
+			size = self.header['rows'] if name != 'names' else self.header['name_bytes']
+			if size:
+				self.columns[name] = numpy.memmap(self.filename('%s.bin' % name), dtype=dtype, mode='r', shape=(size,))
+			else:
+				self.columns[name] = numpy.zeros(0, dtype=dtype)
+		return self.columns[name]
+
+	def select(self, window=None, member=None, project=None):
+		'''
+		Returns the rows of the tasks of a window (a date), a member and a
+		project (their names), either as a slice or as an array of row
+		numbers.
+		'''
+		rows = slice(0, self.header['rows'])
+		if window is not None:
+			rows = slice(*self.windows.get(window.toordinal(), (0, 0)))
+		for name, table, value in (('member', 'members', member), ('project', 'projects', project)):
+			if value is None:
+				continue
+			if table == 'projects':
+				indexes = [i for i, (id, project_name) in enumerate(self.header[table]) if project_name == value]
+			else:
+				indexes = [i for i, member_name in enumerate(self.header[table]) if member_name == value]
+			values = self.column(name)[rows]
+			matches = numpy.flatnonzero(numpy.in1d(values, indexes))
+			rows = matches + rows.start if isinstance(rows, slice) else rows[matches]
+		return rows
+
+	def names(self, rows):
+		'''
+		Returns the names of the tasks in rows.
+		'''
+		heap = self.column('names')
+		offsets = self.column('name_offset')[rows]
+		lengths = self.column('name_length')[rows]
+		return [heap[offset:offset + length].tobytes().decode('utf-8') for offset, length in zip(offsets, lengths)]
+
+	def tasks(self, window=None, member=None, project=None):
+		'''
+		Returns the selected tasks as ExportedTasks, in the order in which
+		they were exported.
+		'''
+		rows = self.select(window, member, project)
+		columns = dict([(name, self.column(name)[rows]) for name in ('id', 'window', 'completed_on', 'workspace', 'project', 'member')])
+		return [ExportedTask(date.fromordinal(int(window_ordinal)), self.header['workspaces'][workspace], self.header['projects'][project_index][1],
+			self.header['members'][member_index], int(id), name, date.fromordinal(int(completed_on)))
+			for id, window_ordinal, completed_on, workspace, project_index, member_index, name in
+			zip(columns['id'], columns['window'], columns['completed_on'], columns['workspace'], columns['project'], columns['member'], self.names(rows))]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import re
+import json
+import time
+import cProfile
+import logging
+import threading
+
+from contextlib import contextmanager
+
+log = logging.getLogger()
+
+PREFIX = 'asana_stats'
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+
+class Histogram(object):
+	'''
+	Counts observed durations in the fixed BUCKETS, together with their sum,
+	minimum and maximum.
+	'''
+	def __init__(self):
+		self.counts = [0] * (len(BUCKETS) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.min = None
+		self.max = None
+
+	def observe(self, value):
+		i = 0
+		while i < len(BUCKETS) and value > BUCKETS[i]:
+			i += 1
+		self.counts[i] += 1
+		self.count += 1
+		self.sum += value
+		self.min = value if self.min is None else min(self.min, value)
+		self.max = value if self.max is None else max(self.max, value)
+
+	def cumulative(self):
+		total = 0
+		for le, count in zip(BUCKETS + ['+Inf'], self.counts):
+			total += count
+			yield le, total
+
+
+class Metrics(object):
+	'''
+	Counters and latency histograms of a run, keyed by name and tags. Phases
+	push their tags on a per-thread context so that everything measured
+	within a phase, such as the Asana requests made while fetching the tasks
+	of a project, is tagged with the report, workspace or project as well.
+	'''
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.context = threading.local()
+		self.counters = {}
+		self.histograms = {}
+		self.profile_dir = None
+
+	def tags(self, **tags):
+		current = dict(getattr(self.context, 'tags', {}))
+		current.update([(key, value) for key, value in tags.iteritems() if value is not None])
+		return current
+
+	def key(self, name, tags):
+		return name, tuple(sorted([(key, unicode(value)) for key, value in self.tags(**tags).iteritems()]))
+
+	def increment(self, name, value=1, **tags):
+		key = self.key(name, tags)
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, name, seconds, **tags):
+		key = self.key(name, tags)
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram()
+			self.histograms[key].observe(seconds)
+
+	@contextmanager
+	def timer(self, name, **tags):
+		'''
+		Times an external call as <name>_seconds, failed calls are counted
+		in <name>_errors as well.
+		'''
+		start = time.time()
+		try:
+			yield
+		except:
+			self.increment('%s_errors' % name, **tags)
+			raise
+		finally:
+			self.observe('%s_seconds' % name, time.time() - start, **tags)
+
+	@contextmanager
+	def phase(self, name, **tags):
+		'''
+		Times a phase of the pipeline as phase_seconds{phase=name}. Its tags
+		apply to everything measured within the phase on the same thread.
+		When profile_dir is set, phases that are not nested in another phase
+		on the main thread are run under cProfile and dumped to profile_dir.
+		'''
+		previous = getattr(self.context, 'tags', {})
+		self.context.tags = self.tags(**tags)
+		profiler = None
+		if self.profile_dir and not previous and isinstance(threading.current_thread(), threading._MainThread):
+			profiler = cProfile.Profile()
+			profiler.enable()
+		start = time.time()
+		try:
+			yield
+		finally:
+			seconds = time.time() - start
+			if profiler:
+				profiler.disable()
+				self.dump_profile(profiler, name)
+			self.observe('phase_seconds', seconds, phase=name)
+			self.context.tags = previous
+
+	def dump_profile(self, profiler, name):
+		if not os.path.exists(self.profile_dir):
+			os.makedirs(self.profile_dir)
+		parts = [name] + [unicode(value) for key, value in sorted(self.tags().iteritems())]
+		path = os.path.join(self.profile_dir, '%s.prof' % re.sub(r'[^\w.-]+', '_', '-'.join(parts)))
+		profiler.dump_stats(path)
+		log.info('Saved profile of %s to %s' % (name, path))
+
+	def summary(self):
+		with self.lock:
+			counters = sorted(self.counters.items())
+			histograms = sorted(self.histograms.items())
+		return {
+			'counters': [{'name': name, 'tags': dict(tags), 'value': value} for (name, tags), value in counters],
+			'histograms': [{
+				'name': name,
+				'tags': dict(tags),
+				'count': histogram.count,
+				'sum': histogram.sum,
+				'min': histogram.min,
+				'max': histogram.max,
+				'buckets': [[le, count] for le, count in histogram.cumulative()],
+			} for (name, tags), histogram in histograms],
+		}
+
+	def prometheus(self):
+		'''
+		Returns the metrics in the Prometheus text exposition format.
+		'''
+		with self.lock:
+			counters = sorted(self.counters.items())
+			histograms = sorted(self.histograms.items())
+		lines = []
+		typed = set()
+		for (name, tags), value in counters:
+			metric = '%s_%s_total' % (PREFIX, name)
+			if metric not in typed:
+				lines.append('# TYPE %s counter' % metric)
+				typed.add(metric)
+			lines.append('%s%s %s' % (metric, format_labels(tags), value))
+		for (name, tags), histogram in histograms:
+			metric = '%s_%s' % (PREFIX, name)
+			if metric not in typed:
+				lines.append('# TYPE %s histogram' % metric)
+				typed.add(metric)
+			for le, count in histogram.cumulative():
+				lines.append('%s_bucket%s %s' % (metric, format_labels(tags + (('le', unicode(le)),)), count))
+			lines.append('%s_sum%s %r' % (metric, format_labels(tags), histogram.sum))
+			lines.append('%s_count%s %s' % (metric, format_labels(tags), histogram.count))
+		return '\n'.join(lines) + '\n'
+
+	def save(self, json_file=None, prometheus_file=None):
+		'''
+		Writes the JSON summary and the Prometheus text file. Both are written
+		to a temporary file first so that a collector never reads half a file.
+		'''
+		for path, data in ((json_file, lambda: json.dumps(self.summary(), indent=2, sort_keys=True)), (prometheus_file, self.prometheus)):
+			if path:
+				path = os.path.expanduser(path)
+				fh = open('%s.tmp' % path, 'w')
+				fh.write(data().encode('utf-8'))
+				fh.close()
+				os.rename('%s.tmp' % path, path)
+				log.info('Saved metrics to %s' % path)
+
+
+def format_labels(tags):
+	if not tags:
+		return ''
+	return '{%s}' % ','.join(['%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in tags])
+
+
+metrics = Metrics()
@@ -21,14 +21,28 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
 import sys
+import time
+import json
 import calendar
 import logging
 import argparse
+import functools
+import itertools
 import dateutil.relativedelta
 
 import pyasana
+import asana_api
+from cache import Cache
+from bucketing import Buckets, parse_timestamps
+from multiprocessing.pool import ThreadPool
 from datetime import datetime, timedelta, date
 from report import Report
+from taskstore import TaskStore, TaskRecord
+from statistics import TeamStatistics
+from export import TaskExport
+from sender import close_sessions, flush_sessions, flush_output
+from metrics import metrics
+from backfill import Backfill, BackfillState
 
 from yaml import load
 try:
@@ -48,24 +62,13 @@ log.addHandler(ch)
 
 ON_POSIX = 'posix' in sys.builtin_module_names
 
-class Logger(object):
-	def __init__(self, func):
-		self.func = func
-		
-	def __get__(self, obj, cls=None):
-		return self.__class__(self.func.__get__(obj, cls))
-
-	def __call__(self, *args, **kwargs):
-		output = self.func(*args, **kwargs)
-		if kwargs != {} and kwargs != None:
-			logging.info('Called %s with result: %s and kwargs: %s' % (self.func.__name__, output, ';'.join(['%s=%s' % (key, value) for key, value in kwargs.iteritems()])))
-		else:
-			logging.info('Called %s with result: %s' % (self.func.__name__, str(output)))
-		return output
-
+# Seconds after which the cached tasks of a project are checked against a
+# listing of their ids, the incremental sync does not see tasks that were
+# deleted or moved to another project.
+RECONCILE_INTERVAL = 86400
 
 class Progress(object):
-	def __init__(self, name, frequency, ignore_projects, team_members, output, time_frame, asana_api_key, args):
+	def __init__(self, name, frequency, ignore_projects, team_members, output, time_frame, asana_api_key, args, concurrency=1, cache_dir=None, cache_max_age=30, requests_per_minute=100, max_requests_per_minute=None, api=None, crawl='projects', statistics=False, export_dir=None):
 		self.name = name
 		self.frequency = frequency
 		self.ignore_projects = ignore_projects
@@ -76,18 +79,62 @@ class Progress(object):
 		self.dryrun = True  # args.dry_run
 		self.time_frame = time_frame
 		self.format_choices = ['wiki', 'email']
+		self.crawl_choices = ['projects', 'assignees', 'auto']
+		self.crawl_strategy = crawl
+		self.project_names = {}
+		self.statistics = statistics
 		self.frequency_choices = ['weekly', 'monthly']
 		self.number_report = int(args.number_reports)	
-		self.tasks = {}
-		self.create_tasks_dictionary()
-		self.validate_input()
+		self.workers = int(args.workers)
+		self.hydrate = args.hydrate
+		self.refresh = args.refresh
+		self.concurrency = int(concurrency)
+		self.pool = None
+		self.traversal_pool = None
+		self.today = date.today()
+		if api is not None:
+			self.api = api
+		elif args.replay:
+			self.api = asana_api.ReplayApi(args.replay, self.asana_api_key, -1)
+			self.today = self.api.archive.recorded_on
+			cache_dir = None
+		elif args.record:
+			self.api = asana_api.RecordingApi(args.record, self.asana_api_key, int(requests_per_minute), 100, max_requests_per_minute)
+			cache_dir = None
+		else:
+			self.api = asana_api.Api(self.asana_api_key, int(requests_per_minute), 100, max_requests_per_minute)
 		self.start_date = None
 		self.end_date = None
-		self.set_time_frame()
+		self.tasks = None
+		self.crawled = set()
+		self.reset(self.today)
+		self.validate_input()
 		# self.dt = self.max_age()
 		# self.init_report_class(output, args)
-		self.api = pyasana.Api(self.asana_api_key, 100)
-		self.workspaces = self.api.get_workspaces()
+		self.cache_dir = cache_dir
+		self.cache_max_age = int(cache_max_age)
+		self.cache = None
+		self.export_dir = export_dir
+
+	def reset(self, today):
+		'''
+		Sets up the report windows that end before today. The tasks of the
+		windows that an earlier run has crawled and that are still reported
+		are kept, so that a Progress that is kept between runs only crawls
+		the windows that are new.
+		'''
+		self.today = today
+		previous = self.tasks
+		self.tasks = TaskStore()
+		self.create_tasks_dictionary()
+		self.crawled = set([window for window in self.tasks.windows() if window in self.crawled])
+		if previous is not None:
+			for record in previous.records:
+				if record.window in self.crawled:
+					self.tasks.add(*record)
+		self.set_time_frame()
+		uncrawled = [window for window in self.tasks.windows() if window not in self.crawled]
+		self.completed_since = min(uncrawled) if uncrawled else None
 
 	def generate_key(self, start_date, end_date):
 		if not isinstance(start_date, date) or not isinstance(end_date, date):
@@ -96,8 +143,8 @@ class Progress(object):
 			return '%s-%s' % (str(start_date), str(end_date))
 
 	def set_time_frame(self):
-		self.start_date = min(self.tasks.keys())
-		self.end_date = max(self.tasks.keys())
+		self.start_date = min(self.tasks.windows())
+		self.end_date = max(self.tasks.windows())
 
 	def construct_time_window(self, obs_date=date.today(), number=1):
 		if self.frequency == 'weekly':
@@ -114,19 +161,22 @@ class Progress(object):
 		return start_date, end_date	
 		
 	def create_tasks_dictionary(self):
+		windows = []
+		self.windows = []
 		for number in xrange(self.number_report):
 			number += 1
-			start_date, end_date = self.construct_time_window(number=number)
+			start_date, end_date = self.construct_time_window(obs_date=self.today, number=number)
 			# key = self.generate_key(start_date, end_date)
-			self.tasks.setdefault(start_date, {})
+			self.tasks.add_window(start_date)
+			self.windows.append((start_date, end_date))
+			if self.frequency == 'monthly':
+				# monthly windows end on the last day of the month, not the first day of the next one
+				end_date += timedelta(days=1)
+			windows.append((start_date, end_date))
+		self.buckets = Buckets(windows)
 
 	def task_finished_during_time_window(self, task):
-		task.completed_at = self.parse_timestamp(task.completed_at)
-		start_date, end_date = self.construct_time_window(task.completed_at)
-		if start_date >= self.start_date and end_date <= self.end_date:
-			return start_date
-		else:
-			return None
+		return self.buckets.bucket_days([task.completed_on])[0]
 
 	def max_age(self):
 		if self.frequency == 'weekly':
@@ -135,60 +185,398 @@ class Progress(object):
 			number_of_days_in_month = calendar.monthrange(self.start_date.year, self.start_date.month)[1]
 			return timedelta(days=number_of_days_in_month)
 
-	def parse_project(self, project):
-		for ig in self.ignore_projects:
+	def parse_project(self, project, ignore_projects=None):
+		if ignore_projects is None:
+			ignore_projects = self.ignore_projects
+		for ig in ignore_projects:
 			if project.name == ig:
 				return False
 		return True
 
 	def is_team_member(self, task):
-		if task.assignee and task.assignee.name in self.team_members:
+		if task.assignee and task.assignee in self.team_members:
 			return True
 		else:
 			return False
 
-	def parse_timestamp(self, timestamp):
-		timestamp = timestamp[:-5]
-		timestamp = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
-		return timestamp.date()
-
-	def parse_tasks(self, api, tasks):
+	def hydrate_tasks(self, api, tasks):
+		'''
+		Fetch the details of each task, using the thread pool when more than
+		one worker has been configured. Results are yielded in the same order
+		as the tasks were listed, as soon as they arrive.
+		'''
+		task_ids = [task.id for task in tasks]
+		if self.pool:
+			return self.pool.imap(api.get_task, task_ids)
+		else:
+			return itertools.imap(api.get_task, task_ids)
+
+	def get_workspaces(self):
+		workspaces = self.cache.get_workspaces() if self.cache else None
+		if workspaces is None:
+			workspaces = self.api.get_workspaces()
+			if self.cache:
+				self.cache.set_workspaces(workspaces)
+		return workspaces
+
+	def get_projects(self, workspace):
+		projects = self.cache.get_projects(workspace.id) if self.cache else None
+		if projects is None:
+			projects = self.api.get_projects(workspace.id)
+			if self.cache:
+				self.cache.set_projects(workspace.id, projects)
+		return projects
+
+	def fetch_cached_tasks(self, workspace, project):
+		'''
+		Lists the modification timestamps of all the tasks in a project and
+		only hydrates the tasks that are new or that have changed since they
+		were cached. Tasks that no longer exist are removed from the cache.
+		'''
+		cached = {} if self.refresh else self.cache.get_tasks(project.id)
+		listing = self.api.find_tasks(project=project.id, fields=['modified_at'])
+		changed = [task for task in listing if task.id not in cached or cached[task.id][0] != task.modified_at]
+		hydrated = dict([(task.id, task) for task in self.hydrate_tasks(self.api, changed)])
+		listed = set([task.id for task in listing])
+		log.info('Project %s: %s tasks from cache, %s fetched' % (project.name, len(listing) - len(hydrated), len(hydrated)))
+		self.cache.set_tasks(project.id, hydrated.values())
+		self.cache.remove_tasks(project.id, [task_id for task_id in cached if task_id not in listed])
+		self.cache.set_sync(workspace.id, project.id, None, None)
+		return [hydrated[task.id] if task.id in hydrated else cached[task.id][1] for task in listing]
+
+	def sync_tasks(self, workspace, project):
+		'''
+		Merges the tasks that have been modified since the last successful
+		sync of a project into the cache and returns the cached tasks of the
+		project that are open or that were completed since completed_since.
+		A full sync is done the first time a project is seen or when the
+		report windows start before the history that has been synced. Tasks
+		that were completed before the earliest report window are removed
+		from the cache, the synced history then starts at that window.
+		'''
+		synced_at = self.api.format_datetime(datetime.utcnow())
+		completed_since = str(self.completed_since)
+		sync = self.cache.get_sync(project.id)
+		reconciled_at = time.time()
+		if sync and sync[0] and sync[1] and sync[0] <= completed_since:
+			tasks = self.api.find_tasks(project=project.id, modified_since=sync[1])
+			completed_since = max(sync[0], min(str(self.start_date), completed_since))
+			pruned = self.cache.prune_tasks(project.id, completed_since)
+			log.info('Project %s: %s tasks modified since %s, %s tasks completed before %s removed' % (project.name, len(tasks), sync[1], pruned, completed_since))
+			self.cache.set_tasks(project.id, tasks)
+			if sync[2] and reconciled_at - sync[2] < RECONCILE_INTERVAL:
+				reconciled_at = sync[2]
+			else:
+				self.reconcile_tasks(project, completed_since)
+		else:
+			tasks = self.api.find_tasks(project=project.id, completed_since=self.completed_since)
+			self.cache.clear_tasks(project.id)
+			log.info('Project %s: full sync of %s tasks' % (project.name, len(tasks)))
+			self.cache.set_tasks(project.id, tasks)
+		self.cache.set_sync(workspace.id, project.id, completed_since, synced_at, reconciled_at)
+		return sorted([task for modified_at, task in self.cache.get_tasks(project.id, str(self.completed_since)).itervalues()], key=lambda task: task.id)
+
+	def reconcile_tasks(self, project, completed_since):
+		'''
+		Removes the cached tasks that are no longer in a project, because
+		they were deleted or moved, by listing only the ids of its tasks that
+		are open or were completed since completed_since.
+		'''
+		listed = set([task.id for task in self.api.iter_tasks(project=project.id, completed_since=datetime.strptime(completed_since, '%Y-%m-%d').date(), fields=['id'])])
+		removed = [task_id for task_id in self.cache.get_task_ids(project.id, completed_since) if task_id not in listed]
+		self.cache.remove_tasks(project.id, removed)
+		log.info('Project %s: %s tasks are no longer in the project' % (project.name, len(removed)))
+
+	def fetch_tasks(self, workspace, project):
+		'''
+		By default only the tasks that were completed since the start of the
+		earliest report window are requested, with just the fields that are
+		needed for the report, or only the tasks that changed since the last
+		sync when the cache is enabled. When hydrate is set every task of the
+		project is listed and then fetched individually.
+		'''
+		if self.hydrate:
+			if self.cache:
+				return self.fetch_cached_tasks(workspace, project)
+			tasks = self.api.get_tasks(project=project.id)
+			return self.hydrate_tasks(self.api, tasks)
+		elif self.cache:
+			return self.sync_tasks(workspace, project)
+		else:
+			return self.api.iter_tasks(project=project.id, completed_since=self.completed_since)
+
+	def filter_tasks(self, tasks, project_ids=None):
+		'''
+		Keeps the completed tasks that are not section headings as
+		TaskRecords, with their completed_at timestamp parsed into a day.
+		Tasks are consumed a page at a time so that tasks that are paged in
+		lazily are filtered as they arrive. Without project_ids the projects
+		of every task are taken from the task itself.
+		'''
+		tasks = iter(tasks)
+		while True:
+			page = list(itertools.islice(tasks, self.api.page_size))
+			if not page:
+				break
+			completed = [task for task in page if task.completed and not task.name.endswith(':')]
+			if project_ids is None:
+				for task in completed:
+					for project in task.projects or []:
+						self.project_names[project.id] = project.name
+			records = [TaskRecord.from_task(task, completed_at, project_ids if project_ids is not None else tuple([project.id for project in task.projects or []])) for task, completed_at in itertools.izip(completed, parse_timestamps([task.completed_at for task in completed]))]
+			metrics.increment('tasks_fetched', len(page))
+			metrics.increment('tasks_completed', len(records))
+			for record in records:
+				yield record
+
+	def parse_tasks(self, tasks):
 		data = {}
-		for task in tasks:
-			task = api.get_task(task.id)
-			if task.completed:
-				if not task.name.endswith(':'):
-					key = self.task_finished_during_time_window(task)
-					if key:
-						data.setdefault(key, [])
-						data[key].append(task)
+		keys = self.buckets.bucket_days([task.completed_on for task in tasks])
+		for task, key in itertools.izip(tasks, keys):
+			if key:
+				data.setdefault(key, [])
+				data[key].append(task)
 		return data
 	
-	def run(self):
-		for workspace in self.workspaces:
-			log.info('Workspace: %s' % workspace.name)
-			projects = self.api.get_projects(workspace.id)
+	def map(self, func, iterable):
+		'''
+		Applies func to every item using the traversal pool when concurrency
+		is larger than 1, results are returned in the order of iterable.
+		'''
+		if self.traversal_pool:
+			return self.traversal_pool.imap(func, iterable)
+		else:
+			return itertools.imap(func, iterable)
+
+	def list_projects(self, workspace, ignore_projects=None, listed=None):
+		log.info('Workspace: %s' % workspace.name)
+		if listed and workspace.id in listed:
+			projects = listed[workspace.id]
+		else:
+			with metrics.phase('list_projects', report=self.name, workspace=workspace.name):
+				projects = self.get_projects(workspace)
+		return [(workspace, project) for project in projects if self.parse_project(project, ignore_projects)]
+
+	def crawl_project(self, job):
+		'''
+		Returns the completed tasks of a project as they are paged in, or all
+		of them at once when projects are crawled concurrently because the
+		tasks are then handed over from the worker thread.
+		'''
+		workspace, project = job
+		log.info('Parsing project: %s' % project.name)
+		tasks = self.filter_tasks(self.fetch_tasks(workspace, project), (project.id,))
+		if self.traversal_pool:
+			with metrics.phase('fetch_tasks', report=self.name, workspace=workspace.name, project=project.name):
+				tasks = list(tasks)
+		return workspace, project, tasks
+
+	def crawl_assignee(self, job):
+		'''
+		Returns the completed tasks that are assigned to a user within a
+		workspace, see crawl_project.
+		'''
+		workspace, user = job
+		log.info('Parsing tasks of: %s' % user.name)
+		tasks = self.filter_tasks(self.api.iter_tasks(workspace=workspace.id, assignee=user.id, completed_since=self.completed_since, fields=asana_api.ASSIGNEE_TASK_FIELDS))
+		if self.traversal_pool:
+			with metrics.phase('fetch_tasks', report=self.name, workspace=workspace.name, assignee=user.name):
+				tasks = list(tasks)
+		return workspace, user, tasks
+
+	def list_assignees(self, workspace, team_members):
+		with metrics.phase('list_users', report=self.name, workspace=workspace.name):
+			users = self.api.get_workspace_users(workspace.id)
+		return [(workspace, user) for user in users if user.name in team_members]
+
+	def choose_strategy(self, workspaces, team_members, strategy):
+		'''
+		Returns the crawl strategy and, when the projects had to be listed to
+		choose it, the projects of every workspace. The auto strategy crawls
+		by assignee when that takes fewer task listings than crawling every
+		project.
+		'''
+		if strategy != 'auto':
+			return strategy, None
+		listed = dict(itertools.izip([workspace.id for workspace in workspaces], self.map(self.get_projects, workspaces)))
+		number_projects = sum([len(projects) for projects in listed.itervalues()])
+		if len(team_members) * len(workspaces) < number_projects:
+			strategy = 'assignees'
+		else:
+			strategy = 'projects'
+		log.info('Crawling by %s: %s team members in %s workspaces, %s projects' % (strategy, len(team_members), len(workspaces), number_projects))
+		return strategy, listed
+
+	def sample_projects(self, workspaces, listed=None):
+		'''
+		Returns the projects of every workspace that a dry run reports on, the
+		first four projects of a workspace that has more than three of them,
+		whichever the crawl strategy.
+		'''
+		if listed is None:
+			listed = dict(itertools.izip([workspace.id for workspace in workspaces], self.map(self.get_projects, workspaces)))
+		return dict([(workspace_id, projects[0:4] if len(projects) > 3 else []) for workspace_id, projects in listed.iteritems()])
+
+	def chunks(self, crawled, owner_tag):
+		'''
+		Yields the tasks of every (workspace, owner, tasks) result of a crawl
+		in chunks of a page, owner being a project or an assignee.
+		'''
+		for workspace, owner, tasks in crawled:
+			tasks = iter(tasks)
+			while True:
+				if self.traversal_pool:
+					chunk = list(itertools.islice(tasks, self.api.page_size))
+				else:
+					with metrics.phase('fetch_tasks', report=self.name, workspace=workspace.name, **{owner_tag: owner.name}):
+						chunk = list(itertools.islice(tasks, self.api.page_size))
+				if not chunk:
+					break
+				yield workspace, owner, chunk
+
+	def stream(self, completed_since=None, ignore_projects=None, team_members=None, strategy=None):
+		'''
+		Fetches the completed tasks of every project that is not ignored and
+		yields them in chunks of (workspace, project, tasks). The chunks do not
+		depend on the report windows, so a single crawl starting at the
+		earliest completed_since of several reports can be fed to all of
+		them, and only one chunk is held at a time.
+
+		The assignees strategy lists the tasks of every team member in each
+		workspace instead of the tasks of every project, the tasks are then
+		grouped by project and the ignored projects are skipped. Tasks that
+		belong to several projects are yielded for each of them, as they are
+		when crawling by project. The cache and hydration only apply to
+		crawling by project. A dry run only covers the sample_projects with
+		either strategy.
+		'''
+		if completed_since is not None:
+			self.completed_since = completed_since
+		if team_members is None:
+			team_members = self.team_members
+		if ignore_projects is None:
+			ignore_projects = self.ignore_projects
+		if self.cache_dir:
+			self.cache = Cache(self.cache_dir, refresh=self.refresh)
+			self.cache.evict(timedelta(days=self.cache_max_age).total_seconds())
+		if self.workers > 1:
+			log.info('Hydrating tasks using %s workers' % self.workers)
+			self.pool = ThreadPool(self.workers)
+		if self.concurrency > 1:
+			log.info('Crawling projects using %s workers' % self.concurrency)
+			self.traversal_pool = ThreadPool(self.concurrency)
+		try:
+			workspaces = self.get_workspaces()
+			strategy, listed = self.choose_strategy(workspaces, team_members, strategy or self.crawl_strategy)
+			sampled = None
 			if self.dryrun:
-				projects = projects[0:4] if len(projects) > 3 else []
-			
-			for project in projects:
-				log.info('Parsing project: %s' % project.name)
-				if self.parse_project(project):
-					tasks = self.api.get_tasks(project=project.id)
-					data = self.parse_tasks(self.api, tasks)
-					for date, tasks in data.iteritems():
-						if any([self.is_team_member(task) for task in tasks]):
-							self.tasks[date].setdefault(project, [])
-						for task in tasks:
-							if self.is_team_member(task):
-								completed_task = '* %s completed by %s on %s' % (task.name, task.assignee.name, task.completed_at)
-								log.info('Task: %s' % completed_task)
-								self.tasks[date].setdefault(project, [])
-								self.tasks[date][project].append(completed_task)
-
-	def create_reports(self):
-		report = Report(self.tasks, self.start_date, self.end_date, self.output, self.frequency, self.verbose, self.dryrun)
-		report.create_statuses()
+				listed = self.sample_projects(workspaces, listed)
+				sampled = set([project.id for projects in listed.itervalues() for project in projects])
+			if strategy == 'assignees':
+				list_assignees = functools.partial(self.list_assignees, team_members=team_members)
+				jobs = itertools.chain.from_iterable(self.map(list_assignees, workspaces))
+				projects = {}
+				for workspace, user, tasks in self.chunks(self.map(self.crawl_assignee, jobs), 'assignee'):
+					by_project = {}
+					for task in tasks:
+						for project_id in task.project_ids:
+							by_project.setdefault(project_id, []).append(task)
+					for project_id, tasks in sorted(by_project.iteritems()):
+						if sampled is not None and project_id not in sampled:
+							continue
+						if project_id not in projects:
+							projects[project_id] = pyasana.Project(project_id, self.project_names.get(project_id))
+						if self.parse_project(projects[project_id], ignore_projects):
+							yield workspace, projects[project_id], tasks
+			else:
+				list_projects = functools.partial(self.list_projects, ignore_projects=ignore_projects, listed=listed)
+				jobs = itertools.chain.from_iterable(self.map(list_projects, workspaces))
+				for chunk in self.chunks(self.map(self.crawl_project, jobs), 'project'):
+					yield chunk
+		finally:
+			for pool in (self.pool, self.traversal_pool):
+				if pool:
+					pool.terminate()
+			self.pool = None
+			self.traversal_pool = None
+			if self.cache:
+				self.cache.close()
+				self.cache = None
+			self.api.close()
+
+	def crawl(self, completed_since=None, ignore_projects=None):
+		'''
+		Returns all the chunks of stream as a snapshot: a list of (workspace,
+		project, tasks) with all the completed tasks of a project.
+		'''
+		snapshot = []
+		with metrics.phase('crawl', report=self.name):
+			for workspace, project, tasks in self.stream(completed_since, ignore_projects):
+				if snapshot and snapshot[-1][1] is project:
+					snapshot[-1][2].extend(tasks)
+				else:
+					snapshot.append((workspace, project, tasks))
+		return snapshot
+
+	def accumulate(self, workspace, project, tasks):
+		'''
+		Buckets the completed tasks of the team members into the report
+		windows, only their TaskRecords are kept.
+		'''
+		if not self.parse_project(project):
+			return
+		reported = 0
+		with metrics.phase('bucket', report=self.name):
+			data = self.parse_tasks(tasks)
+			for window, tasks in data.iteritems():
+				if window in self.crawled:
+					continue
+				for task in tasks:
+					if self.is_team_member(task):
+						log.info('Task: %s' % task.line())
+						self.tasks.add(window, workspace.name, project, task)
+						reported += 1
+		metrics.increment('tasks_reported', reported, report=self.name)
+
+	def run(self, snapshot=None):
+		'''
+		Accumulates the tasks of a snapshot, or streams them from Asana when
+		no snapshot is given.
+		'''
+		if snapshot is None:
+			snapshot = self.stream()
+		for workspace, project, tasks in snapshot:
+			self.accumulate(workspace, project, tasks)
+		self.mark_crawled()
+
+	def mark_crawled(self):
+		'''
+		Records that all windows have been crawled, their tasks are kept by
+		reset and they are not crawled again.
+		'''
+		self.crawled = set(self.tasks.windows())
+		self.completed_since = None
+
+	def export(self):
+		'''
+		Appends the windows that have not been exported yet to the columnar
+		export of the report, when it has one.
+		'''
+		if not self.export_dir:
+			return
+		with metrics.phase('export', report=self.name):
+			TaskExport(self.export_dir).append(self.tasks)
+
+	def team_statistics(self):
+		if not self.statistics:
+			return None
+		with metrics.phase('statistics', report=self.name):
+			return TeamStatistics.from_store(self.tasks)
+
+	def create_reports(self, outputs=None):
+		report = Report(self.tasks, self.start_date, self.end_date, self.output, self.frequency, self.verbose, self.dryrun, self.team_statistics())
+		with metrics.phase('report', report=self.name):
+			report.create_statuses(outputs)
 
 	def validate_input(self):
 		for output in self.output:
@@ -198,6 +586,9 @@ class Progress(object):
 			if self.frequency not in self.frequency_choices:
 				raise Exception('You have specified an invalid frequency: %s.\nValid choices are:' % (self.frequency, ','.join(self.frequency_choices)))
 				sys.exit(-1)
+		if self.crawl_strategy not in self.crawl_choices:
+			raise Exception('You have specified an invalid crawl strategy: %s.\nValid choices are: %s' % (self.crawl_strategy, ','.join(self.crawl_choices)))
+			sys.exit(-1)
 
 	
 # def flatten(input_dictionary, output_dictionary={}):
@@ -215,6 +606,21 @@ def parse_commandline():
 	parser.add_argument('--dry_run', help='This won\'t distribute the status update, primarily for debugging purposes', required=False, default=False, action='store_true')
 	parser.add_argument('--verbose', help='Indicate whether logging to stdout should be turned on.', action='store_true', default=False)
 	parser.add_argument('--number_reports', help='Indicate how far back in time you want to go for generating reports. ', default=1, required=False, action='store')
+	parser.add_argument('--workers', help='Number of tasks that are fetched from Asana in parallel when --hydrate is used, the default of 1 fetches them one after another.', default=1, required=False, action='store')
+	parser.add_argument('--refresh', help='Ignore the cached workspaces, projects and tasks and fetch everything from Asana again.', default=False, action='store_true')
+	parser.add_argument('--record', help='Save all the Asana responses of this run to the given archive so that it can be replayed later. The cache is not used while recording, so that the archive has every response a replay needs.', required=False, default=None, action='store')
+	parser.add_argument('--replay', help='Answer all Asana requests from the given archive instead of the network, the report windows are based on the day the archive was recorded. The cache is not used while replaying.', required=False, default=None, action='store')
+	parser.add_argument('--metrics', help='Save the counters, latency histograms and phase timings of the run to the given JSON file.', required=False, default=None, action='store')
+	parser.add_argument('--prometheus', help='Save the metrics of the run to the given file in the Prometheus text format, e.g. for the node exporter textfile collector.', required=False, default=None, action='store')
+	parser.add_argument('--profile', help='Run every phase under cProfile and save the profiles to the given directory.', required=False, default=None, action='store')
+	parser.add_argument('--backfill', help='Render the report of every window given by --number_reports as a separate job in a pool of processes and deliver them oldest first. An interrupted backfill is resumed when it is started again.', default=False, action='store_true')
+	parser.add_argument('--backfill_state', help='File in which the delivered backfill jobs are kept, remove it to start a backfill from scratch.', required=False, default='~/.asana-stats-backfill.json', action='store')
+	parser.add_argument('--backfill_processes', help='Number of processes that render backfill jobs, defaults to the number of CPUs.', required=False, default=None, type=int)
+	parser.add_argument('--backfill_queue', help='Number of rendered backfill jobs that may wait for delivery per output.', required=False, default=16, type=int)
+	parser.add_argument('--daemon', help='Keep running and create every report when a new report window has ended, the configuration is reloaded when it changes.', default=False, action='store_true')
+	parser.add_argument('--daemon_state', help='File in which the daemon keeps the last report window that every report was created for.', required=False, default='~/.asana-stats-daemon.json', action='store')
+	parser.add_argument('--daemon_interval', help='Seconds between checks for due reports when running as a daemon.', required=False, default=300, type=int)
+	parser.add_argument('--hydrate', help='Fetch every task of a project individually instead of only requesting the recently completed tasks.', default=False, action='store_true')
 	return parser.parse_args()
 
 
@@ -232,22 +638,220 @@ def load_configuration(path):
 	return configuration
 
 
-def main():
-	args = parse_commandline()
-	configuration = load_configuration(args.config)
+def run_reports(progresses):
+	'''
+	Crawls Asana once for all reports and feeds every chunk of tasks to each
+	of them: the crawl starts at the earliest report window, only skips
+	the projects that every report ignores and covers the team members of
+	all reports. Crawling by project is used when any report asks for it,
+	crawling by assignee only when every report allows it. Reports whose
+	windows have all been crawled before are left out.
+	'''
+	progresses = [progress for progress in progresses if progress.completed_since is not None]
+	if not progresses:
+		return
+	completed_since = min([progress.completed_since for progress in progresses])
+	ignore_projects = set.intersection(*[set(progress.ignore_projects or []) for progress in progresses])
+	team_members = set.union(*[progress.team_members for progress in progresses])
+	strategies = set([progress.crawl_strategy for progress in progresses])
+	if 'projects' in strategies:
+		strategy = 'projects'
+	elif 'auto' in strategies:
+		strategy = 'auto'
+	else:
+		strategy = 'assignees'
+	crawler = max(progresses, key=lambda progress: progress.concurrency)
+	log.info('Crawling tasks completed since %s for %s reports' % (completed_since, len(progresses)))
+	with metrics.phase('crawl', report=crawler.name):
+		for workspace, project, tasks in crawler.stream(completed_since, ignore_projects, team_members, strategy):
+			for progress in progresses:
+				progress.accumulate(workspace, project, tasks)
+	for progress in progresses:
+		progress.mark_crawled()
+
+
+def create_progresses(configuration, args, apis=None):
+	'''
+	Returns a (report, Progress) tuple for every report in the configuration.
+	When a dictionary of apis is given the reports share one Asana client per
+	API key and rate, which is kept in that dictionary.
+	'''
 	reports = [report for report in configuration.get('reports', {}).keys() if report.startswith('report')]
-	for report in reports:
-		settings = configuration.get('reports', {}).get(report)
+	progresses = []
+	for report in sorted(reports):
+		settings = dict(configuration.get('reports', {}).get(report) or {})
 		if settings:
-			log.info('Creating report %s' % report)
+			settings['output'] = dict(settings['output'])
 			settings['output']['email'] = settings['output'].get('email', {})
 			settings['output']['wiki'] = settings['output'].get('wiki', {})
 			settings['asana_api_key'] = configuration.get('asana_api_key')
+			settings['cache_dir'] = configuration.get('cache_dir')
+			settings['cache_max_age'] = configuration.get('cache_max_age', 30)
+			if configuration.get('export_dir'):
+				settings['export_dir'] = os.path.join(configuration.get('export_dir'), report)
+			settings['requests_per_minute'] = configuration.get('asana_requests_per_minute', 100)
+			settings['max_requests_per_minute'] = configuration.get('asana_max_requests_per_minute')
 			settings['args'] = args
-			progress = Progress(**settings)
-			progress.run() 
-			progress.create_reports()
-			log.info('Finished creating report %s' % report)
+			if apis is not None and not args.replay and not args.record:
+				key = (settings['asana_api_key'], settings['requests_per_minute'], settings['max_requests_per_minute'])
+				if key not in apis:
+					apis[key] = asana_api.Api(settings['asana_api_key'], int(settings['requests_per_minute']), 100, settings['max_requests_per_minute'])
+				settings['api'] = apis[key]
+			progresses.append((report, Progress(**settings)))
+	return progresses
+
+
+class Service(object):
+	'''
+	Runs the reports of a configuration on their schedule within a single
+	long-running process. A report is due once a new report window has
+	ended, so weekly reports run every Monday and monthly reports on the
+	first of the month. The Asana clients, the SMTP and wiki sessions and
+	the tasks of the windows that have been crawled are kept between runs,
+	the configuration is reloaded when its file changes and the last window
+	that every report was delivered to each output is kept in state_file so
+	that a restart does not send the same report twice.
+	'''
+	def __init__(self, config_path, args, state_file, interval=300):
+		self.config_path = os.path.expanduser(config_path)
+		self.args = args
+		self.state_file = os.path.expanduser(state_file)
+		self.interval = interval
+		self.apis = {}
+		self.progresses = []
+		self.modified = None
+		self.state = {}
+		if os.path.exists(self.state_file):
+			fh = open(self.state_file, 'r')
+			self.state = json.load(fh)
+			fh.close()
+
+	def load(self):
+		'''
+		Loads the configuration when it has changed since it was last loaded,
+		a configuration that cannot be loaded is reported and the previous one
+		is kept.
+		'''
+		modified = os.path.getmtime(self.config_path)
+		if modified == self.modified:
+			return
+		try:
+			configuration = load_configuration(self.config_path)
+			self.progresses = create_progresses(configuration, self.args, self.apis)
+			self.modified = modified
+			log.info('Loaded configuration %s with %s reports' % (self.config_path, len(self.progresses)))
+		except Exception, e:
+			if not self.progresses:
+				raise
+			log.error('Could not reload configuration %s, keeping the previous one: %s' % (self.config_path, e))
+			self.modified = modified
+
+	def save(self):
+		fh = open('%s.tmp' % self.state_file, 'w')
+		json.dump(self.state, fh)
+		fh.close()
+		os.rename('%s.tmp' % self.state_file, self.state_file)
+
+	def pending(self, report, progress):
+		'''
+		Returns the outputs of a report that its latest window has not been
+		delivered to yet.
+		'''
+		delivered = self.state.get(report, {})
+		return [output_format for output_format, settings in sorted(progress.output.iteritems()) if settings and delivered.get(output_format) != str(progress.end_date)]
+
+	def due(self, today):
+		'''
+		Returns the reports whose latest window has not been delivered to all
+		outputs yet. The windows of a report only move on when the day
+		changes, the tasks of the windows it already has are kept.
+		'''
+		due = []
+		for report, progress in self.progresses:
+			if progress.today != today:
+				progress.reset(today)
+			if self.pending(report, progress):
+				due.append((report, progress))
+		return due
+
+	def run_report(self, report, progress):
+		'''
+		Delivers a report to each output that is pending on its own, the
+		output is flushed before its delivery is recorded so that a report
+		that was only queued is sent again after a failure.
+		'''
+		progress.export()
+		for output_format in self.pending(report, progress):
+			log.info('Creating report %s for %s' % (report, output_format))
+			try:
+				try:
+					progress.create_reports([output_format])
+				finally:
+					success, seconds, error = flush_output(output_format)
+				if not success:
+					raise Exception(error)
+			except Exception, e:
+				log.exception('Could not deliver report %s to %s: %s' % (report, output_format, e))
+				continue
+			self.state.setdefault(report, {})[output_format] = str(progress.end_date)
+			self.save()
+			log.info('Finished creating report %s for %s' % (report, output_format))
+
+	def run_once(self):
+		self.load()
+		due = self.due(date.today())
+		if not due:
+			return
+		try:
+			run_reports([progress for report, progress in due])
+			for report, progress in due:
+				try:
+					self.run_report(report, progress)
+				except Exception, e:
+					log.exception('Could not create report %s: %s' % (report, e))
+		finally:
+			try:
+				flush_sessions()
+			finally:
+				self.save()
+				metrics.save(self.args.metrics, self.args.prometheus)
+
+	def serve(self):
+		log.info('Running as a daemon, checking for due reports every %ss' % self.interval)
+		try:
+			while True:
+				try:
+					self.run_once()
+				except Exception, e:
+					log.exception('Could not run the due reports: %s' % e)
+				time.sleep(self.interval)
+		finally:
+			close_sessions()
+
+
+def main():
+	args = parse_commandline()
+	metrics.profile_dir = args.profile
+	if args.daemon:
+		Service(args.config, args, args.daemon_state, args.daemon_interval).serve()
+		return
+	configuration = load_configuration(args.config)
+	progresses = create_progresses(configuration, args)
+	if progresses:
+		try:
+			run_reports([progress for report, progress in progresses])
+			state = BackfillState(args.backfill_state) if args.backfill else None
+			for report, progress in progresses:
+				progress.export()
+				log.info('Creating report %s' % report)
+				if state:
+					Backfill(progress, state, args.backfill_processes, args.backfill_queue).run()
+				else:
+					progress.create_reports()
+				log.info('Finished creating report %s' % report)
+		finally:
+			close_sessions()
+			metrics.save(args.metrics, args.prometheus)
 	
 if __name__ == '__main__':
 
@@ -19,34 +19,100 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import os
 import logging
-import pyasana
 
 from cStringIO import StringIO
-from sender import Sender
+from sender import Dispatcher
+from metrics import metrics
 
 log = logging.getLogger()
 
-def add_wikitext(fn):
-	def wrapper(*args, **kwargs):
-		output_format = kwargs.pop('output_format', None)
-		style_element = kwargs.pop('style_element', None)
-		args = list(args)
-		if output_format == 'wiki':
-			elements = {
-					'heading1': '%s%s%s' % ('=', args[1], '='),
-					'heading2': '%s%s%s' % ('==', args[1], '=='),
-					'heading3': '%s%s%s' % ('===', args[1], '==='),
-					}
-			args[1] = elements.get(style_element, args[1])
-			args = tuple(args)
-		return fn(*args, **kwargs) 
-	return wrapper
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+STYLES = {
+	'wiki': {
+		'heading1': '=%s=',
+		'heading2': '==%s==',
+		'heading3': '===%s===',
+	},
+}
+
+PERIODS = {
+	'weekly': 'week',
+	'monthly': 'month',
+}
+
+templates = {}
+renderers = {}
+
+
+def load_template(output_format, part):
+	'''
+	Returns the contents of templates/<output_format>_<part>.txt, every
+	template is only read from disk once per process.
+	'''
+	key = (output_format, part)
+	if key not in templates:
+		fh = open(os.path.join(TEMPLATE_DIR, '%s_%s.txt' % (output_format, part)), 'r')
+		templates[key] = fh.read()
+		fh.close()
+	return templates[key]
+
+
+def get_renderer(output_format):
+	if output_format not in renderers:
+		renderers[output_format] = Renderer(output_format)
+	return renderers[output_format]
+
+
+class Renderer(object):
+	'''
+	Renders the status of a project in a single output format. The header,
+	footer and heading styles are resolved once, the status is then built
+	in a single join.
+	'''
+	def __init__(self, output_format):
+		styles = STYLES.get(output_format, {})
+		self.header = load_template(output_format, 'header')
+		self.footer = load_template(output_format, 'footer')
+		self.heading1 = styles.get('heading1', '%s')
+		self.heading2 = styles.get('heading2', '%s')
+		self.heading3 = styles.get('heading3', '%s')
+
+	def render_statistics(self, summary, frequency):
+		'''
+		Renders the statistics of a window as returned by
+		TeamStatistics.summary.
+		'''
+		period = PERIODS.get(frequency, 'period')
+		lines = ['', self.heading3 % 'Statistics']
+		if summary['delta'] is None:
+			lines.append('Completed tasks: %s' % summary['total'])
+		else:
+			lines.append('Completed tasks: %s (%+d compared to the previous %s)' % (summary['total'], summary['delta'], period))
+		span = summary['velocity_span']
+		lines.append('Velocity: %.1f tasks per %s over the last %s %s%s' % (summary['velocity'], period, span, period, 's' if span != 1 else ''))
+		if summary['members']:
+			lines.append('By team member:')
+			lines.extend(['* %s: %s (%.0f%%)' % (name, count, share * 100) for name, count, share in summary['members']])
+		if len(summary['projects']) > 1:
+			lines.append('By project:')
+			lines.extend(['* %s: %s' % (name, count) for name, count in summary['projects']])
+		lines.append('')
+		return '\n'.join(lines)
+
+	def render(self, subject, project_name, tasks):
+		lines = [self.heading1 % subject, self.heading2 % project_name]
+		lines.extend([task.line() for task in tasks])
+		lines.append('')
+		return ''.join([self.header, '\n'.join(lines), self.footer])
 
 
 class Report(object):
-	def __init__(self, tasks, start_date, end_date, output, frequency, verbose, dryrun):
+	def __init__(self, tasks, start_date, end_date, output, frequency, verbose, dryrun, statistics=None):
 		self.tasks = tasks
+		self.statistics = statistics
 		self.start_date = start_date
 		self.end_date = end_date
 		self.status = StringIO()
@@ -55,6 +121,7 @@ class Report(object):
 		self.verbose = verbose
 		self.frequency = frequency
 		self.dryrun = dryrun
+		self.dispatcher = None
 
 	def __str__(self):
 		return 'Report for period: %s - %s' % (self.start_date, self.end_date)
@@ -62,81 +129,53 @@ class Report(object):
 	def generate_subject(self, project):
 		return 'Analytics %s update for %s <%s-%s>' % (self.frequency, project, self.start_date, self.end_date)
 
-	@add_wikitext
-	def write_line(self, line):
-		self.status.write('%s\n' % line)
-
-	def create_statuses(self):
-		for output_format in self.output.keys():
-			for project_to_report, url in self.output.get(output_format, {}).get('projects', {}).iteritems():
-				self.status = StringIO()
-				for date, projects in self.tasks.iteritems():
-					if project_to_report == 'All':
-						projects = self.tasks.get(date)
-					else:
-						projects = {}
-						key = self.tasks[date].get(project_to_report)
-						projects[key] = self.tasks.get(date).get(key)
-					
-					self.create_status(projects, output_format)
-					if self.status.getvalue() != None and self.subject != None: 
-						self.send(url)
-					#project = pyasana.Project(0, project)
-					#projects = [project] if project in self.tasks[date].keys() else []
+	def create_statuses(self, outputs=None):
+		'''
+		Renders and sends the report of every window, to the given output
+		formats only when outputs is set.
+		'''
+		selected = dict([(output_format, settings) for output_format, settings in self.output.iteritems() if outputs is None or output_format in outputs])
+		self.dispatcher = Dispatcher(selected, self.verbose, self.dryrun)
+		failures = []
+		try:
+			for output_format in selected.keys():
+				for project_to_report, url in selected.get(output_format, {}).get('projects', {}).iteritems():
+					self.status = StringIO()
+					for date in self.tasks.windows():
+						if project_to_report == 'All':
+							projects = self.tasks.group_by_project(date)
+						else:
+							projects = self.tasks.group_by_project(date, project_to_report)
+						
+						self.create_status(projects, output_format, date, None if project_to_report == 'All' else project_to_report)
+						if self.status.getvalue() != None and self.subject != None: 
+							results = self.send(url)
+							failures.extend(['%s (%s): %s' % (self.subject, sent_to, error) for sent_to, (success, seconds, error) in results.iteritems() if not success])
+		finally:
+			self.dispatcher.close()
+		if failures:
+			raise Exception('Could not deliver all reports:\n%s' % '\n'.join(failures))
 		
-	def create_status(self, projects, output_format):
-		for project, tasks in projects.iteritems():
-			if tasks != [] and tasks != None:
-				self.write_header(output_format)
-				self.subject = self.generate_subject(project)
-				self.write_line(self.subject, output_format=self.output, style_element='heading1')
-					#for project in projects:
-						#tasks = data[project]
-						#if tasks != []:
-				self.write_line(project.name, output_format=self.output, style_element='heading2')
-				for task in tasks:
-					self.write_line(task, output_format=self.output)
-				self.write_footer(output_format)
+	def create_status(self, projects, output_format, window=None, project=None):
+		'''
+		Renders the tasks of every project, followed by the statistics of the
+		window (limited to project when its name is given) when the report
+		has statistics and there were tasks to report.
+		'''
+		renderer = get_renderer(output_format)
+		with metrics.phase('render', output=output_format):
+			rendered = False
+			for project_to_render, tasks in projects.iteritems():
+				if tasks != [] and tasks != None:
+					self.subject = self.generate_subject(project_to_render)
+					self.status.write(renderer.render(self.subject, project_to_render.name, tasks))
+					rendered = True
+			if rendered and self.statistics is not None and window is not None:
+				self.status.write(renderer.render_statistics(self.statistics.summary(window, project), self.frequency))
 		
 		if self.verbose:
 			self.status.seek(0)
 			print self.status.getvalue()
 	
 	def send(self, url):
-		for output in self.output.keys():
-			classes = Sender.__subclasses__()
-			for cls in classes:
-				if cls.is_registrar_for(output):
-					params = self.output.get(output)
-					params['subject'] = self.subject
-					params['status'] = self.status
-					params['dryrun'] = self.dryrun
-					params['verbose'] = self.verbose
-					sender = cls(**params)
-					sender.send(url)
-#		for op in self.output:
-#			for cls in Report.__subclasses__():
-#				if cls.is_registrar_for(op):
-#					params = output.get(op)
-#					params['args'] = args
-#					params['output'] = op
-#					params['start_date'] = self.start_date
-#					params['end_date'] = self.end_date
-#					cls = cls(**params)
-#					setattr(self, op, cls)
-#					classes += 1
-#		if classes != count:
-#			raise ValueError('Could not find all classes to handle output format(s) %s.' % ','.join(self.output))
-#			sys.exit(-1)
-		
-	def write_header(self, output_format):
-		fh = open('templates/%s_header.txt' % (output_format), 'r')
-		for line in fh:
-			self.status.write(line)
-		fh.close()
-	
-	def write_footer(self, output_format):
-		fh = open('templates/%s_footer.txt' % (output_format), 'r')
-		for line in fh:
-			self.status.write(line)
-		fh.close()
+		return self.dispatcher.dispatch(url, self.subject, self.status.getvalue())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import time
+import heapq
+import random
+import socket
+import urllib2
+import logging
+import threading
+import itertools
+
+from metrics import metrics
+
+log = logging.getLogger()
+
+# Requests with a lower priority number are sent first: listing workspaces,
+# projects and tasks determines what else has to be fetched, hydrating a
+# single task does not.
+LISTING = 0
+HYDRATION = 1
+
+
+class Scheduler(object):
+	'''
+	A token bucket that spaces out requests to stay within an API quota of
+	requests_per_minute. Each successful request raises the rate a little,
+	up to max_requests_per_minute. A 429 response halves the rate and
+	pauses every request until the Retry-After delay has passed. When
+	several requests wait for a token, the one with the lowest priority
+	number gets it first. Throttled requests, server errors and connection
+	errors are retried up to max_retries times with a jittered exponential
+	backoff.
+	'''
+	def __init__(self, requests_per_minute=100, max_requests_per_minute=None, max_retries=5, backoff=1.0):
+		self.rate = requests_per_minute / 60.0
+		self.min_rate = self.rate / 16
+		self.increase = self.rate / 100
+		self.decreased_at = 0
+		self.max_rate = max(requests_per_minute, max_requests_per_minute or requests_per_minute) / 60.0
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.tokens = 1.0
+		self.updated = time.time()
+		self.paused_until = 0
+		self.waiting = []
+		self.sequence = itertools.count()
+		self.condition = threading.Condition()
+
+	def refill(self, now):
+		self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def acquire(self, priority=LISTING):
+		'''
+		Blocks until a token is available for this request and no request
+		with a higher priority is waiting, returns when the token was given.
+		'''
+		start = time.time()
+		with self.condition:
+			ticket = (priority, next(self.sequence))
+			heapq.heappush(self.waiting, ticket)
+			while True:
+				now = time.time()
+				self.refill(now)
+				if self.waiting[0] == ticket and self.tokens >= 1 and now >= self.paused_until:
+					break
+				if self.waiting[0] != ticket:
+					delay = None
+				elif now < self.paused_until:
+					delay = self.paused_until - now
+				else:
+					delay = (1 - self.tokens) / self.rate
+				self.condition.wait(delay)
+			heapq.heappop(self.waiting)
+			self.tokens -= 1
+			self.condition.notify_all()
+		metrics.observe('asana_wait_seconds', now - start)
+		return now
+
+	def succeeded(self):
+		with self.condition:
+			self.rate = min(self.max_rate, self.rate + self.increase)
+
+	def throttled(self, sent_at, retry_after=None):
+		'''
+		Pauses all requests for retry_after seconds and halves the rate,
+		unless the rate has already been lowered after the throttled request
+		was sent: the other requests that were in flight at that moment are
+		throttled for the same reason.
+		'''
+		with self.condition:
+			if sent_at >= self.decreased_at:
+				self.rate = max(self.min_rate, self.rate / 2)
+				self.decreased_at = time.time()
+				log.info('Asana is throttling requests, lowered the rate to %.1f requests per minute' % (self.rate * 60))
+			self.tokens = min(self.tokens, 0.0)
+			if retry_after:
+				self.paused_until = max(self.paused_until, time.time() + retry_after)
+			self.condition.notify_all()
+		metrics.increment('asana_throttled')
+
+	def delay(self, attempt):
+		return random.uniform(0, self.backoff * 2 ** attempt)
+
+	def call(self, func, priority=LISTING):
+		'''
+		Calls func once a token has been acquired and retries it when it
+		is throttled or fails with a transient error.
+		'''
+		for attempt in xrange(self.max_retries + 1):
+			sent_at = self.acquire(priority)
+			delay = self.delay(attempt)
+			try:
+				result = func()
+			except urllib2.HTTPError, e:
+				if e.code == 429:
+					pause = retry_after(e)
+					self.throttled(sent_at, pause)
+					if pause:
+						# acquire waits until the pause is over
+						delay = 0
+				elif e.code < 500:
+					raise
+				if attempt == self.max_retries:
+					raise
+			except (urllib2.URLError, socket.error), e:
+				if attempt == self.max_retries:
+					raise
+			else:
+				self.succeeded()
+				return result
+			log.info('Asana request failed (%s), retrying in %.1fs' % (e, delay))
+			metrics.increment('asana_retries')
+			time.sleep(delay)
+
+
+def retry_after(error):
+	try:
+		return float(error.info().get('Retry-After'))
+	except (TypeError, ValueError):
+		return None
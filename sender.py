@@ -19,17 +19,35 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import os
 import sys
+import json
 import requests
 import socket
 import smtplib
+import time
 import logging
+import urlparse
+import threading
 
 from functools import partial
+from cStringIO import StringIO
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from email.message import Message
+from metrics import metrics
 
 log = logging.getLogger()
 
+# Number of revisions of a page that are checked for an earlier publication
+# of a report when the ledger has not seen the page before.
+HISTORY_LIMIT = 500
+
+# Seconds an output is given to deliver a report or its queued reports when
+# its settings have no timeout.
+TIMEOUT = 300
+OUTPUT_FORMATS = ['email', 'wiki']
+
 class Sender(object):
     def __init__(self, username, password, subject, status, verbose, dryrun):
         self.username = username
@@ -39,6 +57,167 @@ class Sender(object):
         self.verbose = verbose
         self.dryrun = dryrun
 
+    @classmethod
+    def flush(cls):
+        '''
+        Delivers what the senders of this class have queued, raises an
+        exception when that fails.
+        '''
+        pass
+
+    @classmethod
+    def close(cls):
+        '''
+        Delivers what the senders of this class have queued and closes their
+        sessions, this should be called once at the end of a run.
+        '''
+        pass
+
+def for_each_session(sessions, func):
+    '''
+    Calls func for every session, also when it fails for one of them, and
+    raises the first error afterwards.
+    '''
+    errors = []
+    for session in sessions:
+        try:
+            func(session)
+        except Exception, e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+class SMTPSession(object):
+    '''
+    A long-lived connection to an SMTP server that is shared by all the Email
+    senders of a run with the same host, port and username. Messages are
+    queued and sent in batches of batch_size, if the server drops the
+    connection it is reopened and the message that failed is sent again.
+    '''
+    sessions = {}
+    lock = threading.Lock()
+
+    def __init__(self, host, port, username, password, batch_size=20):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.batch_size = batch_size
+        self.mailer = None
+        self.messages = []
+        self.connections = 0
+        self.sent = 0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get(cls, host, port, username, password, batch_size=20):
+        key = (host, port, username)
+        with cls.lock:
+            if key not in cls.sessions:
+                cls.sessions[key] = cls(host, port, username, password, batch_size)
+            return cls.sessions[key]
+
+    @classmethod
+    def close_all(cls):
+        '''
+        Sends the messages that are still queued and closes all sessions,
+        this should be called once at the end of a run.
+        '''
+        with cls.lock:
+            sessions = cls.sessions.values()
+            cls.sessions = {}
+        for_each_session(sessions, lambda session: session.close())
+
+    @classmethod
+    def flush_all(cls):
+        '''
+        Sends the messages that are still queued but keeps the connections
+        open for the next run of a long-running process.
+        '''
+        with cls.lock:
+            sessions = cls.sessions.values()
+        for_each_session(sessions, lambda session: session.flush())
+
+    def connect(self):
+        try:
+            mailer = smtplib.SMTP(self.host, self.port)
+        except socket.error, e:
+            error = 'Error initializing SMTP host. If you are using localhost, make sure that sendmail is properly configured.\nError message: %s' % e
+            log.error(error)
+            raise Exception(error)
+            sys.exit(-1)
+        mailer.ehlo()
+        if mailer.has_extn('starttls'):
+            mailer.starttls()
+            mailer.ehlo()
+        elif self.host != 'localhost':
+            mailer.close()
+            raise Exception('SMTP host %s does not support STARTTLS, refusing to send the credentials unencrypted.' % self.host)
+            sys.exit(-1)
+        if self.host != 'localhost':
+            try:
+                mailer.login(self.username, self.password)
+            except smtplib.SMTPAuthenticationError, e:
+                raise Exception('The credentials that you provided for host %s are incorrect.\nError message: %s' % (self.host, e))
+                sys.exit(-1)
+        self.connections += 1
+        self.mailer = mailer
+
+    def queue(self, sender, recipients, message):
+        with self.lock:
+            self.messages.append((sender, recipients, message))
+            if len(self.messages) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        '''
+        Sends the queued messages. When that fails the messages that have not
+        been sent are dropped, so that a message the server rejects does not
+        block the queue, it is up to the caller to queue them again.
+        '''
+        with self.lock:
+            retried = False
+            while self.messages:
+                sender, recipients, message = self.messages[0]
+                try:
+                    if self.mailer is None:
+                        with metrics.timer('smtp_connect', host=self.host):
+                            self.connect()
+                    with metrics.timer('smtp_send', host=self.host):
+                        self.mailer.sendmail(sender, recipients, message)
+                except (smtplib.SMTPServerDisconnected, socket.error), e:
+                    if not retried:
+                        log.info('Lost connection to %s, reconnecting: %s' % (self.host, e))
+                        self.mailer = None
+                        retried = True
+                        continue
+                    self.mailer = None
+                    self.drop()
+                    raise
+                except Exception:
+                    self.drop()
+                    raise
+                retried = False
+                self.messages.pop(0)
+                self.sent += 1
+            log.info('Emailed %s reports over %s connection(s) to %s' % (self.sent, self.connections, self.host))
+
+    def drop(self):
+        log.error('Dropping %s unsent message(s) to %s' % (len(self.messages), self.host))
+        metrics.increment('smtp_dropped', len(self.messages), host=self.host)
+        self.messages = []
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            if self.mailer is not None:
+                try:
+                    self.mailer.quit()
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    self.mailer.close()
+                self.mailer = None
+
+
 class Email(Sender):
     def __init__(self, server, sender, recipients, subject, status, verbose, dryrun, projects):
         super(Email, self).__init__(server.get('username'), server.get('password'), subject, status, verbose, dryrun)
@@ -46,6 +225,7 @@ class Email(Sender):
         self.email = sender.get('email')
         self.host = server.get('host')
         self.port = server.get('port')
+        self.batch_size = server.get('batch_size', 20)
         self.recipients = recipients
 
     def send(self, url):
@@ -56,133 +236,655 @@ class Email(Sender):
         msg.add_header('Subject', self.subject)
         msg.set_payload(self.status.getvalue())
 
-        try:
-            mailer = smtplib.SMTP(self.host, self.port)
-        except socket.error, e:
-            error = 'Error initializing SMTP host. If you are using localhost, make sure that sendmail is properly configured.\nError message: %s' % e
-            log.error(error)
-            raise Exception(error)
-            sys.exit(-1)
-        mailer.ehlo()
-        mailer.starttls()
-        mailer.ehlo()
-        
         if self.dryrun == False:
-            if self.host != 'localhost':
-                try:
-                    mailer.login(self.username, self.password)
-                except smtplib.SMTPAuthenticationError, e:
-                    raise Exception('The credentials that you provided for host %s are incorrect.\nError message: %s' % (self.host, e))
-                    sys.exit(-1)
-            log.info('Emailing report...')
-            #mailer.sendmail('%s <%s>' % (self.name, self.email), self.recipients, msg.as_string())
+            log.info('Queueing report for %s...' % ', '.join(self.recipients))
+            session = SMTPSession.get(self.host, self.port, self.username, self.password, self.batch_size)
+            session.queue('%s <%s>' % (self.name, self.email), self.recipients, msg.as_string())
         else:
             print 'From: %s <%s>' % (self.name, self.email)
             print 'To: %s' % ' '.join(self.recipients)
             print 'Message: %s' % msg.as_string()
-    
-        # Should be mailer.quit(), but that crashes...
-        mailer.close()
-        
+
     @classmethod
     def is_registrar_for(cls, report_type):
         '''
         Register this class for the Team progress report
         '''
         return report_type == 'email'
+
+    @classmethod
+    def flush(cls):
+        SMTPSession.flush_all()
+
+    @classmethod
+    def close(cls):
+        SMTPSession.close_all()
     
+class RateLimiter(object):
+    '''
+    Spaces out the edits to a wiki host so that no more than rate edits per
+    minute are made, however many threads are publishing to it.
+    '''
+    limiters = {}
+    lock = threading.Lock()
+
+    def __init__(self, rate):
+        self.interval = 60.0 / rate if rate else 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, host, rate):
+        with cls.lock:
+            if host not in cls.limiters:
+                cls.limiters[host] = cls(rate)
+            return cls.limiters[host]
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Publisher(object):
+    '''
+    Runs the queued edits of a wiki when it is flushed: different titles are
+    published concurrently, the edits to a single title in the order in which
+    they were queued. The latency and outcome of every edit is kept in
+    results as (title, success, seconds, error) tuples.
+    '''
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.titles = []
+        self.jobs = {}
+        self.results = []
+        self.lock = threading.Lock()
+
+    def submit(self, title, job):
+        with self.lock:
+            if title not in self.jobs:
+                self.titles.append(title)
+                self.jobs[title] = []
+            self.jobs[title].append(job)
+
+    def publish_title(self, title):
+        results = []
+        for job in self.jobs[title]:
+            start = time.time()
+            try:
+                job()
+                results.append((title, True, time.time() - start, None))
+            except Exception, e:
+                results.append((title, False, time.time() - start, str(e)))
+        return results
+
+    def flush(self):
+        with self.lock:
+            titles = self.titles
+            self.titles = []
+        if not titles:
+            return []
+        pool = ThreadPool(min(self.concurrency, len(titles)))
+        results = []
+        try:
+            for title_results in pool.imap_unordered(self.publish_title, titles):
+                results.extend(title_results)
+        finally:
+            pool.terminate()
+        with self.lock:
+            for title in titles:
+                del self.jobs[title]
+        for title, success, seconds, error in results:
+            if success:
+                log.info('Published %s in %.2fs' % (title, seconds))
+            else:
+                log.error('Failed to publish %s after %.2fs: %s' % (title, seconds, error))
+        self.results.extend(results)
+        failed = [title for title, success, seconds, error in results if not success]
+        if failed:
+            raise Exception('Could not publish to %s' % ', '.join(failed))
+        return results
+
+
+class WikiSession(object):
+    '''
+    An authenticated session with a MediaWiki API that is shared by all the
+    Wiki senders of a run with the same URL and username. The login cookies
+    and the edit token are reused for every request and are only refreshed
+    when the API reports that they are no longer valid. When session_file is
+    set they are also stored on disk so that the next run can skip the login.
+    '''
+    sessions = {}
+    lock = threading.Lock()
+
+    def __init__(self, base_url, username, password, session_file=None, verbose=False, maxlag=5, edits_per_minute=30, concurrency=1):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.verbose = verbose
+        self.format = 'json'
+        self.maxlag = maxlag
+        self.max_retries = 5
+        self.host = urlparse.urlparse(base_url).netloc
+        self.rate_limiter = RateLimiter.get(self.host, edits_per_minute)
+        self.publisher = Publisher(concurrency)
+        self.session_file = os.path.expanduser(session_file) if session_file else None
+        self.edittoken = None
+        self.logged_in = False
+        # incremented on every login, so that threads that were rejected by
+        # the same expired session log in only once
+        self.generation = 0
+        self.lock = threading.RLock()
+        cookies = self.load()
+        self.session = requests.session(config={'store_cookies': True}, params={'format': self.format}, cookies=cookies)
+
+    @classmethod
+    def get(cls, base_url, username, password, session_file=None, verbose=False, maxlag=5, edits_per_minute=30, concurrency=1):
+        key = (base_url, username)
+        with cls.lock:
+            if key not in cls.sessions:
+                cls.sessions[key] = cls(base_url, username, password, session_file, verbose, maxlag, edits_per_minute, concurrency)
+            return cls.sessions[key]
+
+    @classmethod
+    def close_all(cls):
+        with cls.lock:
+            sessions = cls.sessions.values()
+            cls.sessions = {}
+        try:
+            for_each_session(sessions, lambda session: session.publisher.flush())
+        finally:
+            for session in sessions:
+                session.save()
+
+    @classmethod
+    def flush_all(cls):
+        with cls.lock:
+            sessions = cls.sessions.values()
+        try:
+            for_each_session(sessions, lambda session: session.publisher.flush())
+        finally:
+            for session in sessions:
+                session.save()
+
+    def load(self):
+        '''
+        Returns the cookies of a previous run and restores its edit token.
+        '''
+        if not self.session_file or not os.path.exists(self.session_file):
+            return {}
+        fh = open(self.session_file, 'r')
+        try:
+            data = json.load(fh).get(self.base_url, {})
+        except ValueError:
+            data = {}
+        fh.close()
+        if data.get('username') != self.username:
+            return {}
+        self.edittoken = data.get('edittoken')
+        self.logged_in = bool(data.get('cookies'))
+        return data.get('cookies', {})
+
+    def save(self):
+        if not self.session_file or not self.logged_in:
+            return
+        data = {}
+        if os.path.exists(self.session_file):
+            fh = open(self.session_file, 'r')
+            try:
+                data = json.load(fh)
+            except ValueError:
+                data = {}
+            fh.close()
+        data[self.base_url] = {
+            'username': self.username,
+            'cookies': requests.utils.dict_from_cookiejar(self.session.cookies),
+            'edittoken': self.edittoken,
+        }
+        # the cookies are only ever readable by the owner, the file is
+        # replaced at once so that a crash does not leave half of it behind
+        tmp = '%s.tmp' % self.session_file
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        fh = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w')
+        json.dump(data, fh)
+        fh.close()
+        os.rename(tmp, self.session_file)
+
+    def post(self, **kwargs):
+        '''
+        Sends a request with the maxlag parameter, when the database replicas
+        are lagging the request is retried after the Retry-After delay or an
+        exponential backoff.
+        '''
+        if self.maxlag:
+            kwargs['maxlag'] = self.maxlag
+        for attempt in xrange(self.max_retries + 1):
+            try:
+                with metrics.timer('mediawiki_request', host=self.host, action=kwargs.get('action')):
+                    r = self.session.post(self.base_url, data=kwargs)
+            except requests.exceptions.ConnectionError, e:
+                raise Exception('Difficulties trying to connect to %s. Make sure that this is the correct URL.\nError message: %s, ' % (self.base_url, e))
+                sys.exit(-1)
+
+            if self.verbose:
+                log.info('Mediawiki API results: %s' % r)
+            if r.json is None:
+                raise Exception('Mediawiki API at %s did not return JSON, status code %s.' % (self.base_url, r.status_code))
+            if r.json.get('error', {}).get('code') != 'maxlag' or attempt == self.max_retries:
+                return r.json
+            delay = float(r.headers.get('retry-after') or 2 ** attempt)
+            log.info('Mediawiki API at %s is lagged, retrying in %ss' % (self.base_url, delay))
+            metrics.increment('mediawiki_maxlag_retries', host=self.host)
+            time.sleep(delay)
+
+    def login(self):
+        with self.lock:
+            self.session.cookies.clear()
+            result = self.post(action='login', lgname=self.username, lgpassword=self.password).get('login', {})
+            if result.get('result') == 'NeedToken':
+                result = self.post(action='login', lgname=self.username, lgpassword=self.password, lgtoken=result.get('token')).get('login', {})
+            if result.get('result') != 'Success':
+                raise Exception('Could not login to %s as %s, result: %s' % (self.base_url, self.username, result.get('result')))
+                sys.exit(-1)
+            self.logged_in = True
+            self.edittoken = None
+            self.generation += 1
+            log.info('Logged in to %s' % self.base_url)
+
+    def fetch_edit_tokens(self, titles):
+        '''
+        Fetches the edit tokens of many titles in a single query. The token
+        is the same for every page within a session so it is kept until the
+        API rejects it.
+        '''
+        with self.lock:
+            if not self.logged_in:
+                self.login()
+            result = self.api(action='query', prop='info', intoken='edit', titles='|'.join(titles))
+            tokens = {}
+            for page in result.get('query', {}).get('pages', {}).itervalues():
+                if page.get('edittoken'):
+                    tokens[page.get('title')] = page.get('edittoken')
+                    self.edittoken = page.get('edittoken')
+            return tokens
+
+    def api(self, **kwargs):
+        '''
+        Calls the API, logging in again or fetching a new edit token when the
+        API reports that the session or the token has expired. Only the first
+        of several concurrent requests that are rejected logs in again or
+        fetches the token, the others reuse the result.
+        '''
+        if kwargs.get('action') == 'edit':
+            kwargs['assert'] = 'user'
+            with self.lock:
+                if not self.logged_in:
+                    self.login()
+                if not self.edittoken:
+                    self.fetch_edit_tokens([kwargs.get('title')])
+                kwargs['token'] = self.edittoken
+            self.rate_limiter.wait()
+        generation = self.generation
+        result = self.post(**kwargs)
+        code = result.get('error', {}).get('code')
+        if code in ('notloggedin', 'assertuserfailed', 'assertnameduserfailed'):
+            with self.lock:
+                # another thread may have logged in again since this request was sent
+                if self.generation == generation:
+                    self.login()
+                if kwargs.get('action') == 'edit':
+                    if not self.edittoken:
+                        self.fetch_edit_tokens([kwargs.get('title')])
+                    kwargs['token'] = self.edittoken
+            result = self.post(**kwargs)
+        elif code == 'badtoken':
+            with self.lock:
+                if self.edittoken == kwargs.get('token'):
+                    self.fetch_edit_tokens([kwargs.get('title')])
+                kwargs['token'] = self.edittoken
+            result = self.post(**kwargs)
+        return result
+
+
+class Ledger(object):
+    '''
+    Remembers which subjects have been published to which wiki pages, so
+    that a report that has been published before can be recognised without
+    downloading the history of the page. For every (wiki url, title) it keeps
+    the subjects that have been found or published and the id of the newest
+    revision that has been checked. When ledger_file is not set the ledger only lasts
+    for the current run.
+    '''
+    ledgers = {}
+    lock = threading.Lock()
+
+    def __init__(self, ledger_file=None):
+        self.ledger_file = os.path.expanduser(ledger_file) if ledger_file else None
+        self.lock = threading.RLock()
+        self.pages = {}
+        if self.ledger_file and os.path.exists(self.ledger_file):
+            fh = open(self.ledger_file, 'r')
+            try:
+                self.pages = json.load(fh)
+            except ValueError:
+                log.error('Could not read ledger %s, starting a new one.' % self.ledger_file)
+            fh.close()
+
+    @classmethod
+    def get(cls, ledger_file=None):
+        with cls.lock:
+            if ledger_file not in cls.ledgers:
+                cls.ledgers[ledger_file] = cls(ledger_file)
+            return cls.ledgers[ledger_file]
+
+    @classmethod
+    def close_all(cls):
+        with cls.lock:
+            ledgers = cls.ledgers.values()
+            cls.ledgers = {}
+        for ledger in ledgers:
+            ledger.save()
+
+    @classmethod
+    def save_all(cls):
+        with cls.lock:
+            ledgers = cls.ledgers.values()
+        for ledger in ledgers:
+            ledger.save()
+
+    def page(self, url, title):
+        return self.pages.setdefault(url, {}).setdefault(title, {'revid': None, 'subjects': []})
+
+    def is_published(self, url, title, subject):
+        with self.lock:
+            for published in self.page(url, title)['subjects']:
+                if published.find(subject) > -1:
+                    return True
+            return False
+
+    def last_revid(self, url, title):
+        with self.lock:
+            return self.page(url, title)['revid']
+
+    def add(self, url, title, subjects, revid=None):
+        with self.lock:
+            page = self.page(url, title)
+            page['subjects'].extend(subjects)
+            if revid is not None and revid > page['revid']:
+                page['revid'] = revid
+            self.save()
+
+    def save(self):
+        if not self.ledger_file:
+            return
+        with self.lock:
+            fh = open('%s.tmp' % self.ledger_file, 'w')
+            json.dump(self.pages, fh)
+            fh.close()
+            os.rename('%s.tmp' % self.ledger_file, self.ledger_file)
+
+
 class Wiki(Sender):
-    def __init__(self, username, password, url, projects, subject, status, verbose, dryrun):
+    def __init__(self, username, password, url, projects, subject, status, verbose, dryrun, session_file=None, ledger_file=None, maxlag=5, edits_per_minute=30, concurrency=1):
         super(Wiki, self).__init__(username, password, subject, status, verbose, dryrun)
         self.base_url = url
         self.projects = projects
-        self.format = 'json'
-        self.session = requests.session(config={'store_cookies': True}, params={'format': self.format})
-        
-        self.lgtoken = None
-        self.sessionid = None
-        self.edittoken = None
-    
+        self.concurrency = concurrency
+        self.session = WikiSession.get(self.base_url, self.username, self.password, session_file, verbose, maxlag, edits_per_minute, concurrency)
+        self.ledger = Ledger.get(ledger_file)
+
     def __call__(self):
-        self.login()
-    
+        self.session.login()
+
     def __getattr__(self, attr):
         return partial(self.api, action=attr)
 
     def send(self, title):
-        #wiki = Wiki(credentials.get('username'), credentials.get('password'), credentials.get('base_url'))
-        self.login()
-#        for project, title in self.titles.iteritems():
-#           self.create_status(progress, project)
-            #if is_published == False:
-        published = self.report_has_been_published(title, self.subject)
+        '''
+        Publishes the status to title right away, or queues it on the session
+        when concurrency is larger than 1 so that all queued titles are
+        published concurrently when the sessions are closed.
+        '''
+        if self.concurrency > 1 and self.dryrun != True:
+            self.session.publisher.submit(title, partial(self.publish, title, self.subject, self.status.getvalue()))
+        else:
+            self.publish(title, self.subject, self.status.getvalue())
+
+    def publish(self, title, subject, text):
+        published = self.report_has_been_published(title, subject)
         if not published:
             if self.dryrun != True:
                 log.info('Updating article %s...' % title)
-                self.get_token(titles=title, prop='info|revisions', intoken='edit')
-                self.edit(title=title, section=0, summary=self.subject, sectiontitle='', text=self.status.getvalue(), token=self.edittoken)
+                if not self.session.edittoken:
+                    self.session.fetch_edit_tokens(self.projects.values())
+                result = self.edit(title=title, section=0, summary=subject, sectiontitle='', text=text)
+                if 'error' in result:
+                    raise Exception('Could not update article %s on %s.\nError message: %s' % (title, self.base_url, result['error'].get('info', result['error'].get('code'))))
                 log.info('Added status update.')
+                self.ledger.add(self.base_url, title, [subject], result.get('edit', {}).get('newrevid'))
         else:
             print 'Wiki Article: %s' % title
-            print 'Text: %s' % self.status.getvalue()     
-                
-        #wiki.login()
-        #wiki.query(titles=credentials.get('title').get('all'), prop='info|revisions', intoken='edit')
-        #wiki.edit(title=credentials.get('title').get('all'), section=0, summary=subject, sectiontitle='', text=msg, token=wiki.edittoken)
-
-
-    # def create_authorization_url(self):
-    #     return '%s%s' % (self.base_url, self.authorization_url)
-    
-    # def create_edit_token_url(self):
-    #     return '%s%s&format=%s' % (self.base_url, self.edit_token_url, self.format)    
+            print 'Text: %s' % text
 
     def api(self, **kwargs):
-        kwargs.update({'lgname': self.username})
-        kwargs.update({'lgpassword': self.password})
-        try:
-            r = self.session.post(self.base_url, params=kwargs)
-        except requests.exceptions.ConnectionError, e:
-            raise Exception('Difficulties trying to connect to %s. Make sure that this is the correct URL.\nError message: %s, ' % (self.base_url, e))
-            sys.exit(-1)
-        
-        if self.verbose:
-            log.info('Mediawiki API results: %s' % r)
-            
-        if 'login' in r.json:
-            data = r.json['login']
-            kwargs.update({'lgtoken': data.get('token')})
-            r = self.session.post(self.base_url, params=kwargs)
-            if 'login' in r.json:
-                authenticated = r.json['login']
-                self.lgtoken = authenticated.get('lgtoken')
-                self.lguserid = authenticated.get('lguserid')
-                self.sessionid = authenticated.get('sessionid')
-        elif 'get_token' in r.json:
-            key = r.json['query']['pages'].keys()[0]
-            data = r.json['query']['pages'].get(key)
-            self.edittoken = data.get('edittoken')
-        elif 'query' in r.json:
-            return r.json
-#        elif 'edit' in r.json:
-#            print r.json
-#        else:
-#            print r.json
-        
+        return self.session.api(**kwargs)
+
     def report_has_been_published(self, title, subject):
+        '''
+        Checks the ledger first and otherwise the revisions of the page that
+        are newer than the newest revision that has been checked before,
+        following the API continuation until all of them have been seen. A
+        page that has not been checked before only has its latest
+        HISTORY_LIMIT revisions checked. Only the subject is kept in the
+        ledger, when it was found.
+        '''
         if title.find('Sandbox') > -1:
             return False
-        revisions = self.query(titles=title, prop='info|revisions', rvlimit=500)
-        pages = revisions.get('query', {}).get('pages', {}).keys()
-        for page in pages:
-            for revision in revisions.get('query', {}).get('pages', {}).get(page, {}).get('revisions', {}):
-                if revision.get('comment', '').find(subject) > -1:
-                    return True
-        return False
-   
+        if self.ledger.is_published(self.base_url, title, subject):
+            return True
+        params = {'titles': title, 'prop': 'revisions', 'rvprop': 'ids|comment', 'rvlimit': HISTORY_LIMIT}
+        last_revid = self.ledger.last_revid(self.base_url, title)
+        if last_revid:
+            params['rvendid'] = last_revid
+        revids = []
+        published = False
+        while True:
+            revisions = self.query(**params)
+            for page in revisions.get('query', {}).get('pages', {}).itervalues():
+                for revision in page.get('revisions', []):
+                    revids.append(revision.get('revid'))
+                    if revision.get('comment', '').find(subject) > -1:
+                        published = True
+            continuation = revisions.get('continue') or revisions.get('query-continue', {}).get('revisions')
+            if not continuation or not last_revid:
+                break
+            params.update(continuation)
+        self.ledger.add(self.base_url, title, [subject] if published else [], max(revids) if revids else None)
+        return published
+
     @classmethod
     def is_registrar_for(cls, report_type):
         '''
         Register this class for the Team progress report
         '''
         return report_type == 'wiki'
+
+    @classmethod
+    def flush(cls):
+        try:
+            WikiSession.flush_all()
+        finally:
+            Ledger.save_all()
+
+    @classmethod
+    def close(cls):
+        try:
+            WikiSession.close_all()
+        finally:
+            Ledger.close_all()
+
+
+class Dispatcher(object):
+    '''
+    Delivers a rendered report to all the configured outputs at once. The
+    sender class of every output is looked up once, each delivery runs on
+    its own thread and is given timeout seconds (the timeout setting of the
+    output, TIMEOUT by default) to finish, so the slowest sender determines
+    how long a delivery takes rather than the sum of all of them. The same
+    holds for flushing the reports that the outputs have queued.
+    '''
+    # the largest timeout of every output format of the run, used when the
+    # sessions are flushed or closed
+    timeouts = {}
+
+    def __init__(self, output, verbose, dryrun):
+        self.verbose = verbose
+        self.dryrun = dryrun
+        self.senders = []
+        for output_format, params in output.iteritems():
+            if not params:
+                continue
+            for cls in Sender.__subclasses__():
+                if cls.is_registrar_for(output_format):
+                    params = dict(params)
+                    timeout = params.pop('timeout', TIMEOUT)
+                    self.senders.append((output_format, cls, params, timeout))
+                    Dispatcher.timeouts[output_format] = max(timeout, Dispatcher.timeouts.get(output_format, 0))
+        self.pool = ThreadPool(len(self.senders)) if self.senders else None
+
+    def deliver(self, cls, params, url):
+        sender = cls(**params)
+        sender.send(url)
+
+    def dispatch(self, url, subject, status):
+        '''
+        Sends status to all outputs and returns a dictionary of output format
+        to a (success, seconds, error) tuple. Email and concurrent wiki
+        outputs only queue the report, for them the tuple covers queueing
+        and the outcome of the delivery is returned by flush.
+        '''
+        start = time.time()
+        deliveries = []
+        for output_format, cls, params, timeout in self.senders:
+            params = dict(params)
+            params['subject'] = subject
+            params['status'] = StringIO(status)
+            params['dryrun'] = self.dryrun
+            params['verbose'] = self.verbose
+            deliveries.append((output_format, timeout, self.pool.apply_async(self.deliver, (cls, params, url))))
+
+        results = {}
+        for output_format, timeout, delivery in deliveries:
+            try:
+                delivery.get(max(0, start + timeout - time.time()))
+                results[output_format] = (True, time.time() - start, None)
+            except TimeoutError:
+                results[output_format] = (False, time.time() - start, 'timed out after %ss' % timeout)
+            except Exception, e:
+                results[output_format] = (False, time.time() - start, str(e))
+        for output_format, (success, seconds, error) in results.iteritems():
+            metrics.observe('delivery_seconds', seconds, output=output_format)
+            if not success:
+                metrics.increment('delivery_errors', output=output_format)
+            if success:
+                log.info('Dispatched %s to %s in %.2fs' % (subject, output_format, seconds))
+            else:
+                log.error('Could not deliver %s to %s: %s' % (subject, output_format, error))
+        return results
+
+    def flush(self):
+        '''
+        Delivers the reports that the outputs have queued and returns a
+        dictionary of output format to a (success, seconds, error) tuple.
+        '''
+        return flush_outputs(dict([(output_format, timeout) for output_format, cls, params, timeout in self.senders]), pool=self.pool)
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+
+def flush_output(output_format, close=False):
+    '''
+    Delivers the reports that have been queued for an output, and closes its
+    sessions when close is set, and returns a (success, seconds, error)
+    tuple.
+    '''
+    start = time.time()
+    try:
+        for cls in Sender.__subclasses__():
+            if cls.is_registrar_for(output_format):
+                if close:
+                    cls.close()
+                else:
+                    cls.flush()
+        result = (True, time.time() - start, None)
+    except Exception, e:
+        log.error('Could not deliver the queued reports to %s: %s' % (output_format, e))
+        metrics.increment('flush_errors', output=output_format)
+        result = (False, time.time() - start, str(e))
+    metrics.observe('flush_seconds', result[1], output=output_format)
+    return result
+
+
+def flush_outputs(timeouts, close=False, pool=None):
+    '''
+    Flushes, or closes when close is set, every output of timeouts on its
+    own thread and returns a dictionary of output format to a (success,
+    seconds, error) tuple. Every output is given its timeout to finish, so
+    the slowest output determines how long flushing takes.
+    '''
+    start = time.time()
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(len(timeouts) or 1)
+    try:
+        flushes = [(output_format, timeout, pool.apply_async(flush_output, (output_format, close))) for output_format, timeout in sorted(timeouts.iteritems())]
+        results = {}
+        for output_format, timeout, flush in flushes:
+            try:
+                results[output_format] = flush.get(max(0, start + timeout - time.time()))
+            except TimeoutError:
+                log.error('Could not deliver the queued reports to %s: timed out after %ss' % (output_format, timeout))
+                metrics.increment('flush_errors', output=output_format)
+                results[output_format] = (False, time.time() - start, 'timed out after %ss' % timeout)
+        return results
+    finally:
+        if own_pool:
+            # a flush that timed out is left to finish on its own thread
+            pool.close()
+
+
+def flush_all_outputs(close):
+    '''
+    Flushes or closes the sessions of all output formats at once and raises
+    an exception when any of them failed.
+    '''
+    timeouts = dict([(output_format, Dispatcher.timeouts.get(output_format, TIMEOUT)) for output_format in OUTPUT_FORMATS])
+    results = flush_outputs(timeouts, close)
+    errors = ['%s: %s' % (output_format, error) for output_format, (success, seconds, error) in sorted(results.iteritems()) if not success]
+    if errors:
+        raise Exception('Could not deliver the queued reports to %s' % ', '.join(errors))
+
+
+def close_sessions():
+    '''
+    Sends the queued emails and wiki edits concurrently, closes the SMTP and
+    wiki sessions and saves the publication ledgers, this should be called
+    once at the end of a run.
+    '''
+    flush_all_outputs(True)
+
+
+def flush_sessions():
+    '''
+    Sends the queued emails and wiki edits concurrently and saves the
+    publication ledgers while keeping the sessions open, this is called at
+    the end of every run of the daemon.
+    '''
+    flush_all_outputs(False)
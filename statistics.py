@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import operator
+import itertools
+import numpy
+
+# Number of windows over which the velocity of the team is averaged.
+VELOCITY_SPAN = 4
+
+
+class TeamStatistics(object):
+	'''
+	Counts of the completed tasks of a report per window, team member and
+	project. The tasks are loaded once into arrays of member index, project
+	index and completion day, every statistic is then computed with NumPy
+	operations over those arrays instead of a loop over the tasks.
+	'''
+	def __init__(self, windows, members, projects, days, velocity_span=VELOCITY_SPAN):
+		'''
+		windows are the sorted start dates of the report windows, members and
+		projects the names that the member and project arrays index, days
+		the completion day numbers (date.toordinal) of the tasks.
+		'''
+		self.windows = list(windows)
+		self.window_index = dict([(window, i) for i, window in enumerate(self.windows)])
+		self.member_names = list(members[0])
+		self.project_names = list(projects[0])
+		self.project_index = dict([(name, i) for i, name in enumerate(self.project_names)])
+		self.members = members[1]
+		self.projects = projects[1]
+		self.days = days
+		self.velocity_span = velocity_span
+		starts = numpy.array([window.toordinal() for window in self.windows], dtype=numpy.int32)
+		self.window_of_task = numpy.searchsorted(starts, self.days, side='right') - 1
+		self.member_counts_by_project = {}
+		self.project_counts_by_window = None
+
+	@classmethod
+	def from_store(cls, store, velocity_span=VELOCITY_SPAN):
+		'''
+		Loads the records of a TaskStore, only their assignee, project and
+		completion day are kept.
+		'''
+		size = len(store.records)
+		members, member_array = index_array(store.by_assignee, size)
+		projects, project_array = index_array(store.by_project, size)
+		tasks = itertools.imap(operator.attrgetter('task'), store.records)
+		days = numpy.fromiter(itertools.imap(operator.attrgetter('completed_on'), tasks), dtype=numpy.int32, count=size)
+		return cls(store.windows(), (members, member_array), (projects, project_array), days, velocity_span)
+
+	def member_counts(self, project=None):
+		'''
+		Returns a windows x members array with the number of tasks completed
+		by every member in every window, limited to a project when its name
+		is given. The counts are computed once per project.
+		'''
+		if project not in self.member_counts_by_project:
+			windows, members = self.window_of_task, self.members
+			if project is not None:
+				mask = self.projects == self.project_index.get(project, -1)
+				windows, members = windows[mask], members[mask]
+			size = len(self.windows) * len(self.member_names)
+			keys = windows.astype(numpy.int64) * len(self.member_names) + members
+			self.member_counts_by_project[project] = numpy.bincount(keys, minlength=size)[:size].reshape(len(self.windows), len(self.member_names))
+		return self.member_counts_by_project[project]
+
+	def project_counts(self):
+		'''
+		Returns a windows x projects array with the number of tasks that were
+		completed in every project in every window.
+		'''
+		if self.project_counts_by_window is None:
+			size = len(self.windows) * len(self.project_names)
+			keys = self.window_of_task.astype(numpy.int64) * len(self.project_names) + self.projects
+			self.project_counts_by_window = numpy.bincount(keys, minlength=size)[:size].reshape(len(self.windows), len(self.project_names))
+		return self.project_counts_by_window
+
+	def totals(self, project=None):
+		return self.member_counts(project).sum(axis=1)
+
+	def velocity(self, project=None):
+		'''
+		Returns the average number of tasks completed per window over the
+		last velocity_span windows, for every window.
+		'''
+		totals = self.totals(project)
+		cumulative = numpy.concatenate([[0], numpy.cumsum(totals)])
+		ends = numpy.arange(1, len(totals) + 1)
+		starts = numpy.maximum(ends - self.velocity_span, 0)
+		return (cumulative[ends] - cumulative[starts]) / (ends - starts).astype(numpy.float64)
+
+	def deltas(self, project=None):
+		'''
+		Returns the change in the number of completed tasks compared to the
+		previous window, the first window has no previous window and gets 0.
+		'''
+		totals = self.totals(project)
+		return numpy.concatenate([[0], numpy.diff(totals)])
+
+	def member_share(self, project=None):
+		'''
+		Returns a windows x members array with the fraction of the tasks of a
+		window that every member completed, 0 for windows without tasks.
+		'''
+		counts = self.member_counts(project).astype(numpy.float64)
+		totals = counts.sum(axis=1)[:, numpy.newaxis]
+		return numpy.divide(counts, totals, out=numpy.zeros_like(counts), where=totals > 0)
+
+	def summary(self, window, project=None):
+		'''
+		Returns the statistics of a single window as plain Python values for
+		the report renderers, members and projects are sorted by the number of
+		tasks they completed.
+		'''
+		i = self.window_index[window]
+		counts = self.member_counts(project)[i]
+		shares = self.member_share(project)[i]
+		members = [(self.member_names[j], int(counts[j]), float(shares[j])) for j in numpy.argsort(-counts, kind='mergesort') if counts[j]]
+		if project is None:
+			project_counts = self.project_counts()[i]
+			projects = [(self.project_names[j], int(project_counts[j])) for j in numpy.argsort(-project_counts, kind='mergesort') if project_counts[j]]
+		else:
+			projects = [(project, int(counts.sum()))] if counts.sum() else []
+		return {
+			'total': int(counts.sum()),
+			'delta': int(self.deltas(project)[i]) if i > 0 else None,
+			'velocity': float(self.velocity(project)[i]),
+			'velocity_span': min(i + 1, self.velocity_span),
+			'members': members,
+			'projects': projects,
+		}
+
+
+def index_array(index, size):
+	'''
+	Turns a TaskStore index of name to record positions into the list of
+	names and an array with the position of its name for every record.
+	'''
+	names = sorted(index.keys())
+	array = numpy.zeros(size, dtype=numpy.int32)
+	for i, name in enumerate(names):
+		array[numpy.array(index[name], dtype=numpy.int64)] = i
+	return names, array
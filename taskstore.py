@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from collections import namedtuple
+from datetime import date
+
+Record = namedtuple('Record', ['window', 'workspace', 'project', 'task'])
+
+names = {}
+days = {}
+
+
+class TaskRecord(object):
+	'''
+	A completed task with only the fields that a report needs, in place of
+	the pyasana Task with its nested assignee and project objects. Assignee
+	names are interned so that all the tasks of a person share one string,
+	the completion date is kept as a day number (date.toordinal).
+	'''
+	__slots__ = ('id', 'name', 'assignee_id', 'assignee', 'project_ids', 'completed_on')
+
+	def __init__(self, id, name, assignee_id, assignee, project_ids, completed_on):
+		self.id = id
+		self.name = name
+		self.assignee_id = assignee_id
+		self.assignee = names.setdefault(assignee, assignee)
+		self.project_ids = project_ids
+		self.completed_on = completed_on
+
+	def __repr__(self):
+		return 'TaskRecord(%r, %r, %r, %r)' % (self.id, self.name, self.assignee, self.completed_date())
+
+	@classmethod
+	def from_task(cls, task, completed_date, project_ids=()):
+		'''
+		Returns the record of a pyasana Task that was completed on
+		completed_date.
+		'''
+		assignee = task.assignee
+		if assignee:
+			return cls(task.id, task.name, assignee.id, assignee.name, project_ids, completed_date.toordinal())
+		return cls(task.id, task.name, None, None, project_ids, completed_date.toordinal())
+
+	def completed_date(self):
+		return date.fromordinal(self.completed_on)
+
+	def line(self):
+		day = days.get(self.completed_on)
+		if day is None:
+			day = days.setdefault(self.completed_on, str(date.fromordinal(self.completed_on)))
+		return '* %s completed by %s on %s' % (self.name, self.assignee, day)
+
+
+class TaskStore(object):
+	'''
+	Holds the completed tasks of a report together with secondary indexes on
+	report window, project name, assignee and workspace, so that a lookup
+	such as all tasks of project X in window W only touches the matching
+	records.
+	'''
+	def __init__(self):
+		self.records = []
+		self.by_window = {}
+		self.by_project = {}
+		self.by_assignee = {}
+		self.by_workspace = {}
+		self.by_window_project = {}
+
+	def __len__(self):
+		return len(self.records)
+
+	def add_window(self, window):
+		self.by_window.setdefault(window, [])
+
+	def windows(self):
+		return sorted(self.by_window.keys())
+
+	def add(self, window, workspace, project, task):
+		'''
+		Adds a completed TaskRecord, window is the start date of its report
+		window and project the pyasana Project it belongs to.
+		'''
+		i = len(self.records)
+		self.records.append(Record(window, workspace, project, task))
+		self.by_window.setdefault(window, []).append(i)
+		self.by_project.setdefault(project.name, []).append(i)
+		self.by_assignee.setdefault(task.assignee, []).append(i)
+		self.by_workspace.setdefault(workspace, []).append(i)
+		self.by_window_project.setdefault((window, project.name), []).append(i)
+
+	def find(self, window=None, project=None, assignee=None, workspace=None):
+		'''
+		Returns the records that match all the given criteria, in the order
+		in which they were added. The most selective index is scanned and the
+		remaining criteria are checked on its records only.
+		'''
+		if window is not None and project is not None:
+			candidates = [self.by_window_project.get((window, project), [])]
+		else:
+			candidates = []
+			if window is not None:
+				candidates.append(self.by_window.get(window, []))
+			if project is not None:
+				candidates.append(self.by_project.get(project, []))
+		if assignee is not None:
+			candidates.append(self.by_assignee.get(assignee, []))
+		if workspace is not None:
+			candidates.append(self.by_workspace.get(workspace, []))
+		if not candidates:
+			return list(self.records)
+		indexes = min(candidates, key=len)
+		records = [self.records[i] for i in indexes]
+		return [record for record in records if
+			(window is None or record.window == window) and
+			(project is None or record.project.name == project) and
+			(assignee is None or record.task.assignee == assignee) and
+			(workspace is None or record.workspace == workspace)]
+
+	def group_by_project(self, window, project=None):
+		'''
+		Returns a dictionary of pyasana Project to TaskRecords for a window,
+		limited to a single project when its name is given.
+		'''
+		projects = {}
+		for record in self.find(window=window, project=project):
+			projects.setdefault(record.project, []).append(record.task)
+		return projects
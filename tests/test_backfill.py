@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import shutil
+import asyncore
+import logging
+import argparse
+import tempfile
+import threading
+import unittest
+
+import progress
+from backfill import Backfill, BackfillState
+from benchmark import SMTPStandIn
+from sender import close_sessions
+from workload import Workload, FakeAsana
+
+
+class RejectingSMTP(SMTPStandIn):
+	'''
+	Rejects every message once it has accepted the given number of them.
+	'''
+	def __init__(self, accepted):
+		SMTPStandIn.__init__(self)
+		self.accepted = accepted
+
+	def process_message(self, peer, mailfrom, rcpttos, data):
+		if self.messages >= self.accepted:
+			return '550 Mailbox unavailable'
+		self.messages += 1
+
+
+class BackfillTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.state_file = os.path.join(self.directory, 'backfill.json')
+		self.smtp = RejectingSMTP(8)
+		self.thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.01})
+		self.thread.daemon = True
+		self.thread.start()
+		self.workload = Workload(number_tasks=2000, number_projects=4, days=120, seed=1)
+		self.asana = FakeAsana(self.workload).start()
+
+	def tearDown(self):
+		close_sessions()
+		asyncore.close_all()
+		self.thread.join()
+		self.asana.shutdown()
+		shutil.rmtree(self.directory)
+
+	def backfill(self):
+		output = {'email': {'server': {'host': 'localhost', 'port': self.smtp.port, 'batch_size': 100}, 'sender': {'name': 'asana-stats', 'email': 'asana-stats@localhost'}, 'recipients': ['team@localhost'], 'projects': {'All': 'Status'}}}
+		args = argparse.Namespace(verbose=False, dry_run=True, number_reports=12, workers=1, hydrate=False, refresh=False, record=None, replay=None)
+		p = progress.Progress('backfill', 'weekly', [], self.workload.team_members, output, 'workspace', 'key', args, requests_per_minute=-1)
+		p.dryrun = False
+		p.api.API_BASE = self.asana.url
+		progress.run_reports([p])
+		return Backfill(p, BackfillState(self.state_file), 2, 4)
+
+	def test_resumes_without_delivering_twice(self):
+		interrupted = self.backfill()
+		self.assertRaises(Exception, interrupted.run)
+		close_sessions()
+		# only the jobs of the flushes that the server accepted are done
+		self.assertEqual(interrupted.delivered, 8)
+		self.assertEqual(len(BackfillState(self.state_file).done), 8)
+		self.smtp.accepted = 100
+		resumed = self.backfill()
+		resumed.run()
+		close_sessions()
+		self.assertEqual(resumed.delivered, 4)
+		self.assertEqual(self.smtp.messages, 12)
+		finished = self.backfill()
+		finished.run()
+		self.assertEqual(finished.delivered, 0)
+
+
+if __name__ == '__main__':
+	logging.getLogger().setLevel(logging.WARNING)
+	unittest.main()
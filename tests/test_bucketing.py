@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import unittest
+
+from datetime import date
+from bucketing import parse_timestamp, parse_timestamps
+
+
+class ParseTimestampTest(unittest.TestCase):
+	def test_utc(self):
+		self.assertEqual(parse_timestamp('2012-10-01T23:01:23.123Z'), date(2012, 10, 1))
+		self.assertEqual(parse_timestamp('2012-10-01T23:01:23+00:00'), date(2012, 10, 1))
+
+	def test_offsets(self):
+		self.assertEqual(parse_timestamp('2012-10-01T04:30:00+05:00'), date(2012, 9, 30))
+		self.assertEqual(parse_timestamp('2012-10-01T05:03:00+05'), date(2012, 10, 1))
+		self.assertEqual(parse_timestamp('2012-10-01T05:20:00+0530'), date(2012, 9, 30))
+		self.assertEqual(parse_timestamp('2012-10-01T20:00:00.000-04'), date(2012, 10, 2))
+		self.assertEqual(parse_timestamp('2012-10-01T19:30:00-04:30'), date(2012, 10, 2))
+
+	def test_unsupported_offset(self):
+		self.assertRaises(ValueError, parse_timestamp, '2012-10-01T05:20:00+5')
+
+	def test_only_utc_days_are_parsed_once(self):
+		self.assertEqual(parse_timestamps(['2012-10-01T01:00:00Z', '2012-10-01T02:00:00+05', '2012-10-01T03:00:00Z']), [date(2012, 10, 1), date(2012, 9, 30), date(2012, 10, 1)])
+
+
+if __name__ == '__main__':
+	unittest.main()
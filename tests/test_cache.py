@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import sqlite3
+import tempfile
+import unittest
+
+import pyasana
+import progress
+
+from datetime import date, timedelta
+from cache import Cache
+from workload import Workload, FakeAsana
+
+
+def task(task_id, completed_at, modified_at='2012-01-01T00:00:00.000Z'):
+	return pyasana.Task.new_from_json({'id': task_id, 'name': 'Task %s' % task_id, 'completed': completed_at is not None, 'completed_at': completed_at, 'modified_at': modified_at})
+
+
+class CacheTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.cache = Cache(self.directory)
+
+	def tearDown(self):
+		self.cache.close()
+		shutil.rmtree(self.directory)
+
+	def test_prune_keeps_open_and_recent_tasks(self):
+		self.cache.set_tasks(1, [task(1, None), task(2, '2012-01-02T12:00:00.000Z'), task(3, '2012-02-02T12:00:00.000Z')])
+		self.assertEqual(self.cache.prune_tasks(1, '2012-02-01'), 1)
+		self.assertEqual(sorted(self.cache.get_tasks(1).keys()), [1, 3])
+		self.assertEqual(sorted(self.cache.get_tasks(1, '2012-03-01').keys()), [1])
+
+	def test_evict_removes_projects_that_are_no_longer_synced(self):
+		self.cache.set_tasks(1, [task(1, None)])
+		self.cache.set_tasks(2, [task(2, None)])
+		self.cache.set_sync(10, 1, '2012-01-01', '2012-01-01T00:00:00Z')
+		self.cache.set_sync(10, 2, '2012-01-01', '2012-01-01T00:00:00Z')
+		self.cache.db.execute('UPDATE sync SET synced_at = ? WHERE project_id = 2', (time.time() - 7200,))
+		self.cache.evict(3600)
+		self.assertEqual(self.cache.get_tasks(1).keys(), [1])
+		self.assertEqual(self.cache.get_tasks(2), {})
+		self.assertEqual(self.cache.get_sync(2), None)
+
+
+class SyncTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.workload = Workload(number_tasks=1500, number_projects=4, distribution='recent', seed=3)
+		self.server = FakeAsana(self.workload, 0, 50).start()
+		self.reconcile_interval = progress.RECONCILE_INTERVAL
+
+	def tearDown(self):
+		progress.RECONCILE_INTERVAL = self.reconcile_interval
+		self.server.shutdown()
+		shutil.rmtree(self.directory)
+
+	def run_report(self, number_reports, cached=True):
+		args = argparse.Namespace(verbose=False, dry_run=True, number_reports=number_reports, workers=1, hydrate=False, refresh=False, record=None, replay=None)
+		p = progress.Progress('cache', 'weekly', [], self.workload.team_members, {}, 'workspace', 'key', args, requests_per_minute=-1, cache_dir=self.directory if cached else None)
+		p.api.API_BASE = self.server.url
+		progress.run_reports([p])
+		return sorted([(record.window, record.project.name, record.task.id) for record in p.tasks.records])
+
+	def replace_task(self, task_id, project_id=None, **changes):
+		'''
+		Changes a task of the workload, or moves it to project_id, and marks
+		it as modified.
+		'''
+		old_project_id, i = self.workload.task_index[task_id]
+		fields = ['id', 'name', 'completed', 'completed_at', 'modified_at', 'assignee_id']
+		values = dict(zip(fields, self.workload.tasks[old_project_id][i]))
+		values.update(changes)
+		values['modified_at'] = '2099-01-01T00:00:00.000Z'
+		self.remove_task(task_id)
+		project_id = project_id or old_project_id
+		self.workload.task_index[task_id] = (project_id, len(self.workload.tasks[project_id]))
+		self.workload.tasks[project_id].append(tuple([values[field] for field in fields]))
+		self.workload.filtered.clear()
+
+	def remove_task(self, task_id):
+		project_id, i = self.workload.task_index.pop(task_id)
+		self.workload.tasks[project_id][i] = None
+		self.workload.tasks[project_id] = [task for task in self.workload.tasks[project_id] if task is not None]
+		for j, task in enumerate(self.workload.tasks[project_id]):
+			self.workload.task_index[task[0]] = (project_id, j)
+		self.workload.filtered.clear()
+
+	def earliest_completed(self):
+		db = sqlite3.connect(os.path.join(self.directory, 'asana-stats.sqlite'))
+		try:
+			return db.execute('SELECT min(completed_at) FROM tasks').fetchone()[0]
+		finally:
+			db.close()
+
+	def test_incremental_sync_matches_uncached(self):
+		self.assertEqual(self.run_report(5), self.run_report(5, False))
+		opened = [task for task in self.workload.tasks[100000] if not task[2] and self.workload.user_names[task[5]] in self.workload.team_members][0]
+		self.replace_task(opened[0], completed=True, completed_at='%sT12:00:00.000Z' % (date.today() - timedelta(days=10)))
+		requests = self.server.requests
+		cached = self.run_report(5)
+		self.assertTrue(opened[0] in [task_id for window, name, task_id in cached])
+		incremental = self.server.requests - requests
+		requests = self.server.requests
+		self.assertEqual(cached, self.run_report(5, False))
+		self.assertTrue(incremental < self.server.requests - requests)
+
+	def test_prunes_tasks_completed_before_the_windows(self):
+		self.run_report(30)
+		earliest = self.earliest_completed()
+		cached = self.run_report(5)
+		self.assertTrue(self.earliest_completed() > earliest)
+		self.assertEqual(cached, self.run_report(5, False))
+		# the pruned history is synced again when the windows go back further
+		self.assertEqual(self.run_report(10), self.run_report(10, False))
+
+	def test_reconciles_deleted_and_moved_tasks(self):
+		reported = self.run_report(5)
+		deleted, moved = reported[0][2], reported[1][2]
+		self.remove_task(deleted)
+		self.replace_task(moved, [project_id for project_id in sorted(self.workload.tasks) if project_id != self.workload.task_index[moved][0]][0])
+		# within the reconcile interval the deleted task is still cached
+		self.assertTrue(deleted in [task_id for window, name, task_id in self.run_report(5)])
+		progress.RECONCILE_INTERVAL = 0
+		cached = self.run_report(5)
+		self.assertFalse(deleted in [task_id for window, name, task_id in cached])
+		self.assertEqual(cached, self.run_report(5, False))
+
+
+if __name__ == '__main__':
+	logging.getLogger().setLevel(logging.WARNING)
+	unittest.main()
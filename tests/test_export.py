@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+from benchmark import build_store
+from export import TaskExport
+from taskstore import TaskStore, TaskRecord
+
+
+def exported(store, window, member=None):
+	return [(record.task.id, record.project.name, record.task.assignee, record.task.name, record.task.completed_date()) for record in store.find(window=window, assignee=member)]
+
+
+class TaskExportTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'export')
+		self.store, self.windows = build_store(500, 3, 4, 56)
+		self.window = max([record.window for record in self.store.records])
+		project = self.store.find(window=self.window)[0].project
+		self.store.add(self.window, 'Workspace', project, TaskRecord(1000, u'T\xe2che \xfc', 0, 'Team member 0', (project.id,), self.window.toordinal()))
+		# the store of an earlier run, which only had the older windows
+		self.earlier = TaskStore()
+		for record in self.store.records:
+			if record.window in self.windows[:5]:
+				self.earlier.add(*record)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def assertExported(self, export, store):
+		self.assertEqual(len(export), len(store))
+		for window in self.windows:
+			self.assertEqual([(task.id, task.project, task.assignee, task.name, task.completed_date) for task in export.tasks(window)], exported(store, window))
+		self.assertEqual([(task.id, task.project, task.assignee, task.name, task.completed_date) for task in export.tasks(self.window, 'Team member 0')], exported(store, self.window, 'Team member 0'))
+
+	def test_append_adds_only_the_new_windows(self):
+		self.assertEqual(TaskExport(self.path).append(self.earlier), len(self.earlier))
+		added = TaskExport(self.path).append(self.store)
+		self.assertEqual(added, len(self.store) - len(self.earlier))
+		self.assertEqual(TaskExport(self.path).append(self.store), 0)
+		self.assertExported(TaskExport(self.path), self.store)
+
+	def test_interrupted_append_is_truncated(self):
+		TaskExport(self.path).append(self.earlier)
+		fh = open(os.path.join(self.path, 'header.json'), 'r')
+		header = json.load(fh)
+		fh.close()
+		TaskExport(self.path).append(self.store)
+		# an append that wrote its columns but not its header, the next run
+		# has one window less to append
+		fh = open(os.path.join(self.path, 'header.json'), 'w')
+		json.dump(header, fh)
+		fh.close()
+		self.assertEqual(len(TaskExport(self.path)), len(self.earlier))
+		later = TaskStore()
+		for record in self.store.records:
+			if record.window != self.window:
+				later.add(*record)
+		TaskExport(self.path).append(later)
+		self.assertExported(TaskExport(self.path), later)
+		self.assertEqual(os.path.getsize(os.path.join(self.path, 'id.bin')), len(later) * 8)
+		self.assertEqual(os.path.getsize(os.path.join(self.path, 'names.bin')), sum([len(record.task.name.encode('utf-8')) for record in later.records]))
+
+
+if __name__ == '__main__':
+	logging.getLogger().setLevel(logging.WARNING)
+	unittest.main()
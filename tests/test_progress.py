@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import logging
+import argparse
+import unittest
+
+import progress
+from workload import Workload, FakeAsana
+
+
+class DryRunTest(unittest.TestCase):
+	def reported(self, server, workload, crawl):
+		args = argparse.Namespace(verbose=False, dry_run=True, number_reports=8, workers=1, hydrate=False, refresh=False, record=None, replay=None)
+		p = progress.Progress('dry run', 'weekly', [], workload.team_members, {}, 'workspace', 'key', args, requests_per_minute=-1, crawl=crawl)
+		p.api.API_BASE = server.url
+		progress.run_reports([p])
+		return sorted([(task.id, project.name) for window in p.tasks.windows() for project, tasks in p.tasks.group_by_project(window).iteritems() for task in tasks])
+
+	def test_same_projects_for_both_strategies(self):
+		workload = Workload(number_tasks=400, number_projects=7, distribution='recent', seed=3)
+		server = FakeAsana(workload).start()
+		try:
+			by_project = self.reported(server, workload, 'projects')
+			by_assignee = self.reported(server, workload, 'assignees')
+			self.assertEqual(by_project, by_assignee)
+			self.assertEqual(set([name for task_id, name in by_assignee]), set(['Project 0', 'Project 1', 'Project 2', 'Project 3']))
+		finally:
+			server.shutdown()
+
+
+if __name__ == '__main__':
+	logging.getLogger().setLevel(logging.WARNING)
+	unittest.main()
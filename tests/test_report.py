@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import asyncore
+import logging
+import threading
+import unittest
+
+from benchmark import SMTPStandIn, FakeMediaWiki, build_store
+from report import Report
+from sender import close_sessions
+
+
+class CreateStatusesTest(unittest.TestCase):
+	def setUp(self):
+		self.smtp = SMTPStandIn()
+		self.smtp_thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.01})
+		self.smtp_thread.daemon = True
+		self.smtp_thread.start()
+		self.wiki = FakeMediaWiki(0, 0)
+		self.wiki_thread = threading.Thread(target=self.wiki.serve_forever)
+		self.wiki_thread.daemon = True
+		self.wiki_thread.start()
+
+	def tearDown(self):
+		close_sessions()
+		asyncore.close_all()
+		self.smtp_thread.join()
+		self.wiki.shutdown()
+
+	def test_delivers_to_email_and_wiki(self):
+		store, windows = build_store(50, 3, 4, 28)
+		output = {
+			'email': {'server': {'host': 'localhost', 'port': self.smtp.port}, 'sender': {'name': 'asana-stats', 'email': 'asana-stats@localhost'}, 'recipients': ['team@localhost'], 'projects': {'All': 'Status'}},
+			'wiki': {'username': 'user', 'password': 'secret', 'url': self.wiki.url, 'projects': {'All': 'Status'}, 'edits_per_minute': None},
+		}
+		report = Report(store, min(windows), max(windows), output, 'weekly', False, False)
+		report.create_statuses()
+		close_sessions()
+		self.assertTrue(self.smtp.messages > 0)
+		# every window is reported under the subject of the whole period, so
+		# the page is only edited once
+		self.assertEqual(self.wiki.edits, 1)
+
+
+if __name__ == '__main__':
+	logging.getLogger().setLevel(logging.WARNING)
+	unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import time
+import urllib2
+import logging
+import unittest
+
+from cStringIO import StringIO
+from asana_api import Api
+from scheduler import Scheduler
+from workload import Workload, FakeAsana
+
+
+class SchedulerTest(unittest.TestCase):
+	def api(self, server, requests_per_minute):
+		api = Api('key', requests_per_minute)
+		api.API_BASE = server.url
+		return api
+
+	def test_stays_under_quota(self):
+		server = FakeAsana(Workload(number_tasks=10), quota=10, quota_window=1).start()
+		try:
+			api = self.api(server, 480)
+			for i in xrange(20):
+				api.get_workspaces()
+			self.assertEqual(server.requests, 20)
+			self.assertEqual(server.throttled, 0)
+		finally:
+			server.shutdown()
+
+	def test_lowers_rate_after_throttling(self):
+		server = FakeAsana(Workload(number_tasks=10), quota=10, quota_window=1).start()
+		try:
+			api = self.api(server, 3000)
+			for i in xrange(40):
+				api.get_workspaces()
+			self.assertEqual(server.requests, 40)
+			# every throttled request halves the rate, which stays below the
+			# initial rate because a success only adds 1% of the initial rate
+			self.assertTrue(0 < server.throttled <= 4)
+			self.assertLess(api.scheduler.rate * 60, 1500)
+		finally:
+			server.shutdown()
+
+	def test_honours_retry_after(self):
+		scheduler = Scheduler(6000)
+		calls = []
+
+		def request():
+			calls.append(time.time())
+			if len(calls) == 1:
+				raise urllib2.HTTPError('http://localhost/', 429, 'Too Many Requests', {'Retry-After': '0.5'}, StringIO(''))
+			return 'ok'
+		self.assertEqual(scheduler.call(request), 'ok')
+		self.assertEqual(len(calls), 2)
+		self.assertTrue(calls[1] - calls[0] >= 0.5)
+		self.assertLess(scheduler.rate * 60, 6000)
+
+
+if __name__ == '__main__':
+	logging.getLogger().setLevel(logging.WARNING)
+	unittest.main()
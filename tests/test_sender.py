@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import time
+import shutil
+import asyncore
+import tempfile
+import threading
+import unittest
+
+from cStringIO import StringIO
+from benchmark import SMTPStandIn, FakeMediaWiki
+from sender import Email, Wiki, SMTPSession, WikiSession, Ledger, close_sessions, flush_sessions, flush_outputs
+
+
+class SMTPSessionTest(unittest.TestCase):
+	def setUp(self):
+		self.server = SMTPStandIn()
+		self.thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.01})
+		self.thread.daemon = True
+		self.thread.start()
+
+	def tearDown(self):
+		SMTPSession.close_all()
+		asyncore.close_all()
+		self.thread.join()
+
+	def email(self, i, batch_size):
+		settings = {
+			'server': {'host': 'localhost', 'port': self.server.port, 'batch_size': batch_size},
+			'sender': {'name': 'asana-stats', 'email': 'asana-stats@localhost'},
+			'recipients': ['team@localhost'],
+			'projects': {},
+		}
+		return Email(subject='Report %s' % i, status=StringIO('* Task %s' % i), verbose=False, dryrun=False, **settings)
+
+	def test_batches_share_one_connection(self):
+		session = SMTPSession.get('localhost', self.server.port, None, None, 20)
+		for i in xrange(19):
+			self.email(i, 20).send(None)
+		self.assertEqual(session.sent, 0)
+		self.assertEqual(self.server.connections, 0)
+		self.email(19, 20).send(None)
+		self.assertEqual(session.sent, 20)
+		for i in xrange(20, 50):
+			self.email(i, 20).send(None)
+		self.assertEqual(session.sent, 40)
+		SMTPSession.close_all()
+		self.assertEqual(session.sent, 50)
+		self.assertEqual(session.connections, 1)
+		self.assertEqual(self.server.connections, 1)
+
+	def test_rejected_batch_is_dropped(self):
+		session = SMTPSession.get('localhost', self.server.port, None, None, 20)
+		self.server.process_message = lambda peer, mailfrom, rcpttos, data: '550 Mailbox unavailable'
+		for i in xrange(3):
+			self.email(i, 20).send(None)
+		self.assertRaises(Exception, session.flush)
+		self.assertEqual(session.messages, [])
+		del self.server.process_message
+		self.email(3, 20).send(None)
+		session.flush()
+		self.assertEqual(session.sent, 1)
+		self.assertEqual(self.server.messages, 1)
+
+	def test_refuses_login_without_starttls(self):
+		# the stand-in does not advertise STARTTLS, 127.0.0.1 is not exempt like localhost
+		session = SMTPSession('127.0.0.1', self.server.port, 'user', 'secret')
+		self.assertRaisesRegexp(Exception, 'does not support STARTTLS', session.connect)
+		self.assertEqual(session.connections, 0)
+		self.assertEqual(session.mailer, None)
+
+
+class WikiSessionTest(unittest.TestCase):
+	def setUp(self):
+		self.server = FakeMediaWiki(0.05, 0)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.titles = dict([('Project %s' % i, 'Status/Project %s' % i) for i in xrange(8)])
+
+	def tearDown(self):
+		WikiSession.close_all()
+		Ledger.close_all()
+		self.server.shutdown()
+
+	def publish(self, subject):
+		for title in sorted(self.titles.itervalues()):
+			wiki = Wiki('user', 'secret', self.server.url, self.titles, subject, StringIO('* Task'), False, False, edits_per_minute=None, concurrency=4)
+			wiki.send(title)
+		WikiSession.flush_all()
+		return wiki.session
+
+	def test_concurrent_edits_log_in_again_once(self):
+		session = self.publish('Week 1')
+		self.assertEqual(self.server.logins, 1)
+		self.server.expired = True
+		self.publish('Week 2')
+		self.assertEqual(self.server.logins, 2)
+		self.assertEqual(session.generation, 2)
+		self.assertEqual(len(session.publisher.results), 16)
+		self.assertTrue(all([success for title, success, seconds, error in session.publisher.results]))
+
+	def test_lagged_edits_are_retried(self):
+		self.server.lagged = 3
+		session = self.publish('Week 1')
+		self.assertEqual(self.server.edits, 11)
+		self.assertTrue(all([success for title, success, seconds, error in session.publisher.results]))
+
+
+class SessionFileTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.session_file = os.path.join(self.directory, 'sessions.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_only_the_owner_can_read_the_cookies(self):
+		session = WikiSession('http://localhost/w/api.php', 'user', 'secret', self.session_file)
+		session.logged_in = True
+		session.edittoken = 'edittoken'
+		session.save()
+		self.assertEqual(os.stat(self.session_file).st_mode & 0777, 0600)
+		self.assertEqual(os.listdir(self.directory), ['sessions.json'])
+		restored = WikiSession('http://localhost/w/api.php', 'user', 'secret', self.session_file)
+		self.assertEqual(restored.edittoken, 'edittoken')
+
+
+class LedgerTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.ledger_file = os.path.join(self.directory, 'ledger.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_failed_save_keeps_the_previous_ledger(self):
+		ledger = Ledger(self.ledger_file)
+		ledger.add('http://localhost/w/api.php', 'Status', ['Week 1'], 1)
+		ledger.pages['http://localhost/w/api.php']['Status']['subjects'].append(object())
+		self.assertRaises(TypeError, ledger.save)
+		restored = Ledger(self.ledger_file)
+		self.assertTrue(restored.is_published('http://localhost/w/api.php', 'Status', 'Week 1'))
+		self.assertEqual(restored.last_revid('http://localhost/w/api.php', 'Status'), 1)
+
+
+class CloseSessionsTest(unittest.TestCase):
+	def setUp(self):
+		self.calls = []
+		self.methods = [(SMTPSession, 'close_all'), (SMTPSession, 'flush_all'), (WikiSession, 'close_all'), (WikiSession, 'flush_all'), (Ledger, 'close_all'), (Ledger, 'save_all')]
+		self.originals = [(cls, name, cls.__dict__[name]) for cls, name in self.methods]
+		for cls, name in self.methods:
+			setattr(cls, name, classmethod(self.recorder('%s.%s' % (cls.__name__, name))))
+
+	def tearDown(self):
+		for cls, name, original in self.originals:
+			setattr(cls, name, original)
+
+	def recorder(self, call):
+		def record(cls):
+			self.calls.append(call)
+			if cls is SMTPSession:
+				raise Exception('SMTP server went away')
+		return record
+
+	def test_close_sessions_saves_after_smtp_failure(self):
+		self.assertRaises(Exception, close_sessions)
+		# the outputs are closed concurrently, the ledgers after the wiki
+		self.assertEqual(sorted(self.calls), ['Ledger.close_all', 'SMTPSession.close_all', 'WikiSession.close_all'])
+		self.assertTrue(self.calls.index('WikiSession.close_all') < self.calls.index('Ledger.close_all'))
+
+	def test_flush_sessions_saves_after_smtp_failure(self):
+		self.assertRaises(Exception, flush_sessions)
+		self.assertEqual(sorted(self.calls), ['Ledger.save_all', 'SMTPSession.flush_all', 'WikiSession.flush_all'])
+		self.assertTrue(self.calls.index('WikiSession.flush_all') < self.calls.index('Ledger.save_all'))
+
+
+class FlushOutputsTest(unittest.TestCase):
+	def setUp(self):
+		self.flushed = {}
+		self.originals = [(cls, cls.__dict__['flush']) for cls in (Email, Wiki)]
+		Email.flush = classmethod(self.flusher('email', 1.0))
+		Wiki.flush = classmethod(self.flusher('wiki', 0.1))
+
+	def tearDown(self):
+		for cls, original in self.originals:
+			cls.flush = original
+
+	def flusher(self, output_format, seconds):
+		def flush(cls):
+			time.sleep(seconds)
+			self.flushed[output_format] = time.time()
+		return flush
+
+	def test_slow_output_does_not_delay_the_others(self):
+		start = time.time()
+		results = flush_outputs({'email': 0.3, 'wiki': 5})
+		self.assertLess(time.time() - start, 0.9)
+		self.assertEqual(self.flushed.keys(), ['wiki'])
+		self.assertEqual(results['wiki'][0], True)
+		self.assertEqual(results['email'], (False, results['email'][1], 'timed out after 0.3s'))
+		# let the flush that timed out finish before the original is restored
+		time.sleep(1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import unittest
+import numpy
+
+from datetime import date
+from statistics import TeamStatistics
+
+
+class TeamStatisticsTest(unittest.TestCase):
+	def setUp(self):
+		self.windows = [date(2026, 1, 5), date(2026, 1, 12)]
+		days = numpy.array([date(2026, 1, 6).toordinal(), date(2026, 1, 13).toordinal(), date(2026, 1, 14).toordinal()], dtype=numpy.int32)
+		members = (['Alice', 'Bob'], numpy.array([0, 1, 1], dtype=numpy.int32))
+		# a project may have any name, also one that other counts could be kept under
+		projects = (['projects', 'Kraken'], numpy.array([0, 0, 1], dtype=numpy.int32))
+		self.statistics = TeamStatistics(self.windows, members, projects, days)
+
+	def test_summary(self):
+		summary = self.statistics.summary(self.windows[1])
+		self.assertEqual(summary['total'], 2)
+		self.assertEqual(summary['delta'], 1)
+		self.assertEqual(summary['velocity'], 1.5)
+		self.assertEqual(summary['members'], [('Bob', 2, 1.0)])
+		self.assertEqual(summary['projects'], [('projects', 1), ('Kraken', 1)])
+
+	def test_project_named_projects(self):
+		self.assertEqual(self.statistics.summary(self.windows[1], 'projects')['total'], 1)
+		self.assertEqual(self.statistics.project_counts().tolist(), [[1, 0], [1, 1]])
+		self.assertEqual(self.statistics.member_counts('projects').tolist(), [[1, 0], [0, 1]])
+
+
+if __name__ == '__main__':
+	unittest.main()
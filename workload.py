@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asana-stats: Generate progress report based from Asana tasks
+Copyright (C) 2012  Diederik van Liere, Wikimedia Foundation
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import math
+import time
+import random
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+import collections
+
+from datetime import date, timedelta
+
+DISTRIBUTIONS = ['uniform', 'recent']
+
+
+class Workload(object):
+	'''
+	A synthetic Asana organisation: workspaces with projects, team members
+	and tasks whose completion dates are spread over the last days days,
+	either uniformly or skewed towards recent days. Tasks are kept as tuples
+	of (id, name, completed, completed_at, modified_at, assignee_id) so that
+	millions of them fit in memory. The same seed gives the same workload.
+	'''
+	def __init__(self, number_workspaces=1, number_projects=10, number_tasks=1000, number_members=10, days=365, distribution='uniform', completed=0.7, seed=0, today=None):
+		if distribution not in DISTRIBUTIONS:
+			raise Exception('Distribution %s is not supported, valid choices are: %s' % (distribution, ','.join(DISTRIBUTIONS)))
+		rand = random.Random(seed)
+		today = today or date.today()
+		timestamps = ['%sT12:00:00.000Z' % (today - timedelta(days=day)) for day in xrange(days)]
+		self.workspaces = [(i + 1, 'Workspace %s' % i) for i in xrange(number_workspaces)]
+		self.users = [(1000 + i, 'Member %s' % i) for i in xrange(number_members)]
+		self.user_names = dict(self.users)
+		self.team_members = [name for user_id, name in self.users[:max(1, number_members / 2)]]
+		self.projects = dict([(workspace_id, []) for workspace_id, name in self.workspaces])
+		self.project_workspace = {}
+		self.project_names = {}
+		self.tasks = {}
+		self.task_index = {}
+		for i in xrange(number_projects):
+			workspace_id = self.workspaces[i % number_workspaces][0]
+			project_id = 100000 + i
+			self.projects[workspace_id].append((project_id, 'Project %s' % i))
+			self.project_names[project_id] = 'Project %s' % i
+			self.project_workspace[project_id] = workspace_id
+			self.tasks[project_id] = []
+		project_ids = sorted(self.tasks.keys())
+		for i in xrange(number_tasks):
+			project_id = project_ids[i % number_projects]
+			if distribution == 'recent':
+				day = min(days - 1, int(rand.expovariate(4.0 / days)))
+			else:
+				day = rand.randrange(days)
+			is_completed = rand.random() < completed
+			task = (10000000 + i, 'Task %s' % i, is_completed, timestamps[day] if is_completed else None, timestamps[day], self.users[rand.randrange(number_members)][0])
+			self.task_index[task[0]] = (project_id, len(self.tasks[project_id]))
+			self.tasks[project_id].append(task)
+		self.filtered = {}
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.task_index)
+
+	def task_json(self, task, fields=None):
+		task_id, name, completed, completed_at, modified_at, assignee_id = task
+		data = {'id': task_id, 'name': name, 'completed': completed, 'completed_at': completed_at, 'modified_at': modified_at, 'assignee': {'id': assignee_id, 'name': self.user_names[assignee_id]}}
+		names = [field.split('.')[0] for field in fields] if fields is not None else None
+		if names is None or 'projects' in names:
+			project_id = self.task_index[task_id][0]
+			data['projects'] = [{'id': project_id, 'name': self.project_names[project_id]}]
+		if names is not None:
+			data = dict([(field, data[field]) for field in ['id'] + names])
+		return data
+
+	def get_task(self, task_id):
+		project_id, i = self.task_index[task_id]
+		data = self.task_json(self.tasks[project_id][i])
+		data['workspace'] = {'id': self.project_workspace[project_id]}
+		return data
+
+	def find_tasks(self, project=None, workspace=None, assignee=None, completed_since=None, modified_since=None):
+		'''
+		Returns the task tuples that match a tasks query, the result is kept so
+		that the following pages of the same query do not filter again.
+		'''
+		key = (project, workspace, assignee, completed_since, modified_since)
+		with self.lock:
+			if key in self.filtered:
+				return self.filtered[key]
+		if project:
+			tasks = self.tasks.get(project, [])
+		else:
+			tasks = [task for project_id in self.tasks if self.project_workspace[project_id] == workspace for task in self.tasks[project_id] if task[5] == assignee]
+		if completed_since:
+			tasks = [task for task in tasks if not task[2] or task[3] >= completed_since]
+		if modified_since:
+			tasks = [task for task in tasks if task[4] >= modified_since]
+		with self.lock:
+			self.filtered[key] = tasks
+		return tasks
+
+
+class FakeAsanaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	'''
+	Serves a Workload through the subset of the Asana API that asana-stats
+	uses, with the latency and maximum page size of the server.
+	'''
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		server = self.server
+		url = urlparse.urlparse(self.path)
+		path = url.path.split('/')[3:]
+		params = dict(urlparse.parse_qsl(url.query))
+		retry_after = server.admit()
+		if retry_after is not None:
+			self.send_response(429)
+			self.send_header('Retry-After', str(retry_after))
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		time.sleep(server.latency)
+		workload = server.workload
+		result = None
+		if path == ['workspaces']:
+			result = {'data': [{'id': workspace_id, 'name': name} for workspace_id, name in workload.workspaces]}
+		elif len(path) == 3 and path[0] == 'workspaces' and path[2] == 'projects':
+			result = {'data': [{'id': project_id, 'name': name} for project_id, name in workload.projects.get(int(path[1]), [])]}
+		elif len(path) == 3 and path[0] == 'workspaces' and path[2] == 'users':
+			result = {'data': [{'id': user_id, 'name': name} for user_id, name in workload.users]}
+		elif path == ['tasks']:
+			tasks = workload.find_tasks(int(params.get('project', 0)) or None, int(params.get('workspace', 0)) or None, int(params.get('assignee', 0)) or None, params.get('completed_since'), params.get('modified_since'))
+			fields = params['opt_fields'].split(',') if 'opt_fields' in params else ['name']
+			offset = int(params.get('offset', 0))
+			limit = min(int(params.get('limit', server.page_size)), server.page_size)
+			result = {'data': [workload.task_json(task, fields) for task in tasks[offset:offset + limit]]}
+			if offset + limit < len(tasks):
+				result['next_page'] = {'offset': str(offset + limit)}
+		elif len(path) == 2 and path[0] == 'tasks':
+			result = {'data': workload.get_task(int(path[1]))}
+		if result is None:
+			self.send_error(404)
+			return
+		body = json.dumps(result)
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class FakeAsana(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	request_queue_size = 64
+
+	def __init__(self, workload, latency=0, page_size=100, quota=None, quota_window=60):
+		BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0), FakeAsanaHandler)
+		self.workload = workload
+		self.latency = latency
+		self.page_size = page_size
+		self.quota = quota
+		self.quota_window = quota_window
+		self.recent = collections.deque()
+		self.requests = 0
+		self.throttled = 0
+		self.lock = threading.Lock()
+		self.url = 'http://localhost:%s/api/1.0' % self.server_address[1]
+
+	def admit(self):
+		'''
+		Enforces a quota of quota requests per quota_window seconds like
+		Asana does, returns the Retry-After delay of a throttled request or
+		None when the request is admitted.
+		'''
+		with self.lock:
+			now = time.time()
+			while self.recent and self.recent[0] <= now - self.quota_window:
+				self.recent.popleft()
+			if self.quota and len(self.recent) >= self.quota:
+				self.throttled += 1
+				return int(math.ceil(self.recent[0] + self.quota_window - now))
+			self.recent.append(now)
+			self.requests += 1
+			return None
+
+	def start(self):
+		thread = threading.Thread(target=self.serve_forever)
+		thread.daemon = True
+		thread.start()
+		return self